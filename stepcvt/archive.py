@@ -0,0 +1,157 @@
+# Archives of exported files
+#
+# Instead of a directory of loose files, the exported files can be
+# written into one zip or tar archive, to a file or to a stream such as
+# stdout. Files are added as soon as they are written (see the on_done
+# callback of export.export) and copied into the archive in chunks, so
+# the archive is written while the remaining parts are meshed.
+#
+# The archive ends with manifest.json, listing every file with its part
+# id, size and SHA-256 checksum. Files with the same content as a file
+# added before are hard links in tar archives. An archive file is written
+# under a temporary name and only replaces the target when complete.
+
+import hashlib
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+
+FORMATS = ("zip", "tar", "tar.gz")
+
+MANIFEST = "manifest.json"
+
+# bytes copied at once
+CHUNK = 1 << 20
+
+
+class _HashingReader:
+    # file wrapper computing the SHA-256 of everything read
+    def __init__(self, fd):
+        self.fd = fd
+        self.sha256 = hashlib.sha256()
+
+    def read(self, size=-1):
+        data = self.fd.read(size)
+        self.sha256.update(data)
+        return data
+
+
+class Archive:
+    """Zip or tar archive of exported files with a manifest"""
+
+    def __init__(self, target, format="zip"):
+        """
+        :param target: name of the archive file or a writable binary stream,
+                       which need not be seekable
+        :param format: one of FORMATS
+        """
+        if format not in FORMATS:
+            raise ValueError(f"Unknown archive format {format}")
+        self.format = format
+        self.files = []  # manifest entries
+        self._members = {}  # name -> manifest entry
+        self._date_time = time.localtime()[:6]
+        self._target = self._tmp_file = None
+        if isinstance(target, (str, os.PathLike)):
+            # the file is replaced when the archive is complete
+            self._target = target
+            self._tmp_file = target = f"{os.fspath(target)}.{os.getpid()}.tmp"
+        if format == "zip":
+            self._zip = zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED)
+        else:
+            mode = "w|gz" if format == "tar.gz" else "w|"
+            if self._tmp_file is not None:
+                self._tar = tarfile.open(target, mode)
+            else:
+                self._tar = tarfile.open(fileobj=target, mode=mode)
+
+    def add(self, name, filename, same_as=None, **info):
+        """
+        Add a file to the archive, unless its name was added before
+        :param name: name in the archive
+        :param filename: file to add
+        :param same_as: name of a member added before with the same content
+        :param info: added to the manifest entry of the file
+        """
+        if name in self._members:
+            # written again, like a file overwritten in a directory
+            return
+        entry = {"name": name}
+        if same_as is not None:
+            source = self._members[same_as]
+            entry.update(sha256=source["sha256"], bytes=source["bytes"])
+            if self.format != "zip":
+                tarinfo = self._tarinfo(name, 0)
+                tarinfo.type = tarfile.LNKTYPE
+                tarinfo.linkname = same_as
+                self._tar.addfile(tarinfo)
+                self._add_entry(entry, info)
+                return
+
+        with open(filename, "rb") as fd:
+            reader = _HashingReader(fd)
+            size = os.fstat(fd.fileno()).st_size
+            if self.format == "zip":
+                with self._zip.open(self._zipinfo(name), "w", force_zip64=True) as dst:
+                    while chunk := reader.read(CHUNK):
+                        dst.write(chunk)
+            else:
+                self._tar.addfile(self._tarinfo(name, size), reader)
+        entry.update(sha256=reader.sha256.hexdigest(), bytes=size)
+        self._add_entry(entry, info)
+
+    def close(self, **manifest):
+        """
+        Write the manifest and close the archive
+        :param manifest: added to the manifest
+        """
+        data = json.dumps(dict(manifest, files=self.files), indent=1).encode()
+        try:
+            if self.format == "zip":
+                self._zip.writestr(self._zipinfo(MANIFEST), data)
+                self._zip.close()
+            else:
+                self._tar.addfile(self._tarinfo(MANIFEST, len(data)), io.BytesIO(data))
+                self._tar.close()
+            if self._tmp_file is not None:
+                os.replace(self._tmp_file, self._target)
+        finally:
+            self._remove_tmp_file()
+
+    def abort(self):
+        """
+        Give up an unfinished archive: an archive file is removed, a stream
+        is left as it is
+        """
+        if self._tmp_file is None:
+            return
+        try:
+            (self._zip if self.format == "zip" else self._tar).close()
+        except OSError:
+            pass
+        finally:
+            self._remove_tmp_file()
+
+    def _remove_tmp_file(self):
+        if self._tmp_file is not None and os.path.exists(self._tmp_file):
+            os.unlink(self._tmp_file)
+
+    def _add_entry(self, entry, info):
+        entry.update(info)
+        self.files.append(entry)
+        self._members[entry["name"]] = entry
+
+    def _zipinfo(self, name):
+        zipinfo = zipfile.ZipInfo(name, self._date_time)
+        zipinfo.compress_type = zipfile.ZIP_DEFLATED
+        return zipinfo
+
+    def _tarinfo(self, name, size):
+        tarinfo = tarfile.TarInfo(name)
+        tarinfo.size = size
+        tarinfo.mtime = time.mktime(self._date_time + (0, 0, -1))
+        tarinfo.mode = 0o644
+        return tarinfo
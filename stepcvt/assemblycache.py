@@ -0,0 +1,209 @@
+# Random access container for parsed STEP assemblies
+#
+# The container starts with a small header that indexes every
+# AssemblyObject of the tree (in pre-order), followed by a data section
+# holding the binary BRep buffers of the shapes:
+#
+#   MAGIC | header length (uint64, little endian) | header (JSON) | data
+#
+# Each header entry records the path of the object in the tree, its
+# name, prototype id, location, color and the offset and length of its
+# BRep buffer in the data section. All occurrences of a prototype point
+# to the same buffer. The data section is memory-mapped, so a shape is
+# only read and deserialized when it is actually needed.
+
+import io
+import json
+import mmap
+import struct
+
+from . import instrumentation
+from .ocp_utils import serialize, deserialize, loc_to_tq
+
+MAGIC = b"STEPCVT\x03"
+_HEADER_LEN = struct.Struct("<Q")
+_ENTRY_KEYS = {
+    "parent",
+    "path",
+    "name",
+    "proto",
+    "loc",
+    "color",
+    "offset",
+    "length",
+    "assembly",
+}
+
+
+class ShapeRef:
+    """Reference to a shape in an AssemblyCache that has not been
+    deserialized yet"""
+
+    __slots__ = ("cache", "offset", "length")
+
+    def __init__(self, cache, offset, length):
+        self.cache = cache
+        self.offset = offset
+        self.length = length
+
+    def load(self):
+        return self.cache.shape(self.offset, self.length)
+
+    def buffer(self):
+        """Return the BRep buffer without deserializing it"""
+        return self.cache.blob(self.offset, self.length)
+
+
+def write(fd, assemblies):
+    """
+    Write assemblies to a binary file object in the indexed cache format
+    :param fd: binary file object opened for writing
+    :param assemblies: list of AssemblyObjects
+    """
+    entries = []
+    blobs = []
+    offset = 0
+    # prototype id -> (offset, length), so that the shape of a prototype
+    # is only stored once, however often it is referenced
+    written = {}
+
+    def walk(objs, parent, path):
+        nonlocal offset
+        for obj in objs:
+            proto = obj.proto
+            if proto in written:
+                blob_offset, length = written[proto]
+            else:
+                if isinstance(obj.shape, ShapeRef):
+                    # copy buffers of shapes that were never deserialized
+                    buffer = obj.shape.buffer()
+                else:
+                    buffer = serialize(obj.shape)
+                if buffer is None:
+                    blob_offset = length = None
+                else:
+                    blob_offset, length = offset, len(buffer)
+                    blobs.append(buffer)
+                    offset += length
+                if proto is not None:
+                    written[proto] = (blob_offset, length)
+
+            entry = {
+                "parent": parent,
+                "path": path + [obj.name],
+                "name": obj.name,
+                "proto": proto,
+                "loc": loc_to_tq(obj.loc),
+                "color": obj.color,
+                "offset": blob_offset,
+                "length": length,
+                "assembly": obj.shapes is not None,
+            }
+            entries.append(entry)
+            if obj.shapes is not None:
+                walk(obj.shapes, len(entries) - 1, entry["path"])
+
+    walk(assemblies, -1, [])
+
+    header = json.dumps(entries).encode("utf-8")
+    fd.write(MAGIC)
+    fd.write(_HEADER_LEN.pack(len(header)))
+    fd.write(header)
+    for blob in blobs:
+        fd.write(blob)
+
+
+def dumps(assemblies):
+    """Return assemblies in the indexed cache format as bytes"""
+    bio = io.BytesIO()
+    write(bio, assemblies)
+    return bio.getvalue()
+
+
+class AssemblyCache:
+    """Read access to assemblies stored in the indexed cache format"""
+
+    def __init__(self, buffer):
+        """
+        :param buffer: bytes or mmap holding the whole container
+        """
+        if buffer[: len(MAGIC)] != MAGIC:
+            raise ValueError("Not a stepcvt assembly cache")
+
+        try:
+            start = len(MAGIC)
+            (header_len,) = _HEADER_LEN.unpack(buffer[start : start + _HEADER_LEN.size])
+            start += _HEADER_LEN.size
+            entries = json.loads(bytes(buffer[start : start + header_len]))
+            if not isinstance(entries, list):
+                raise ValueError("header is no list of entries")
+            data_len = len(buffer) - start - header_len
+            if data_len < 0:
+                raise ValueError("header exceeds the file")
+            for i, entry in enumerate(entries):
+                if _ENTRY_KEYS - entry.keys():
+                    raise ValueError(f"entry {i} lacks {_ENTRY_KEYS - entry.keys()}")
+                if not -1 <= entry["parent"] < i:
+                    raise ValueError(f"bad parent of entry {i}")
+                offset, length = entry["offset"], entry["length"]
+                if (
+                    offset is not None
+                    and not 0 <= offset <= offset + length <= data_len
+                ):
+                    raise ValueError(f"shape of entry {i} exceeds the file")
+        except (struct.error, ValueError, LookupError, TypeError) as e:
+            # truncated or corrupt, handled like a foreign file
+            raise ValueError(f"Invalid stepcvt assembly cache: {e}") from e
+
+        self.buffer = buffer
+        self.entries = entries
+        self.data_offset = start + header_len
+        self._shapes = {}
+
+    @classmethod
+    def open(cls, filename):
+        """Memory-map a cache file, close it when done (or use the cache as
+        context manager)"""
+        with open(filename, "rb") as fd:
+            buffer = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            return cls(buffer)
+        except ValueError:
+            buffer.close()
+            raise
+
+    def close(self):
+        """Unmap the cache file, shapes not deserialized yet can no longer be
+        loaded"""
+        if isinstance(self.buffer, mmap.mmap):
+            self.buffer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def shape(self, offset, length):
+        """
+        Deserialize the BRep buffer at offset in the data section.
+        Shapes are deserialized at most once per cache.
+        :return: TopoDS_Shape
+        """
+        shape = self._shapes.get(offset)
+        if shape is None:
+            with instrumentation.span("deserialize"):
+                shape = deserialize(self.blob(offset, length))
+            self._shapes[offset] = shape
+        return shape
+
+    def blob(self, offset, length):
+        """Return the BRep buffer at offset in the data section as bytes"""
+        start = self.data_offset + offset
+        return bytes(self.buffer[start : start + length])
+
+    def ref(self, entry):
+        """Return a ShapeRef for the shape of a header entry, None if it has no shape"""
+        if entry["offset"] is None:
+            return None
+        return ShapeRef(self, entry["offset"], entry["length"])
@@ -1,7 +1,11 @@
 import ast
-from functools import reduce
+import itertools
+from functools import lru_cache, reduce
 from typing import Dict, Type, Union
 
+# globals of evaluated expressions
+_NO_BUILTINS = {"__builtins__": {}}
+
 
 class UserChoices:
     """Records a user's choices as a key--value store, where the keys
@@ -46,29 +50,35 @@ class ChoiceExpr:
 
     @staticmethod
     def extract_ast_vars(node: ast.AST) -> [str]:
-        """Recursively finds all variables in the given AST
-        Currently only supports boolean expressions
+        """Recursively finds all variables in the given AST, in the order
+        they appear in the expression
         """
         if isinstance(node, ast.Expression):
             return ChoiceExpr.extract_ast_vars(node.body)
         elif isinstance(node, ast.BoolOp):
-            return reduce(
-                lambda l1, l2: l1 + l2,
-                map(ChoiceExpr.extract_ast_vars, node.values),
-                [],
-            )
+            return ChoiceExpr._extract_all(node.values)
         elif isinstance(node, ast.Compare):
-            return ChoiceExpr.extract_ast_vars(node.left) + reduce(
-                lambda l1, l2: l1 + l2,
-                map(ChoiceExpr.extract_ast_vars, node.comparators),
-                [],
-            )
+            return ChoiceExpr._extract_all([node.left] + node.comparators)
+        elif isinstance(node, ast.UnaryOp):
+            return ChoiceExpr.extract_ast_vars(node.operand)
+        elif isinstance(node, ast.BinOp):
+            return ChoiceExpr._extract_all([node.left, node.right])
+        elif isinstance(node, ast.IfExp):
+            return ChoiceExpr._extract_all([node.test, node.body, node.orelse])
+        elif isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+            return ChoiceExpr._extract_all(node.elts)
         elif isinstance(node, ast.Name):
             return [node.id]
         elif isinstance(node, ast.Constant):
             return []
         else:
-            raise AttributeError("unexpected ast construct " + node)
+            raise AttributeError(f"unexpected ast construct {node}")
+
+    @staticmethod
+    def _extract_all(nodes) -> [str]:
+        return reduce(
+            lambda l1, l2: l1 + l2, map(ChoiceExpr.extract_ast_vars, nodes), []
+        )
 
     @staticmethod
     def sanitize_ast(node: ast.AST):
@@ -79,10 +89,12 @@ class ChoiceExpr:
         if isinstance(node, ast.Expression):
             ChoiceExpr.sanitize_ast(node.body)
         elif isinstance(node, ast.BoolOp):
-            map(ChoiceExpr.sanitize_ast, node.values)
+            for value in node.values:
+                ChoiceExpr.sanitize_ast(value)
         elif isinstance(node, ast.Compare):
             ChoiceExpr.sanitize_ast(node.left)
-            map(ChoiceExpr.sanitize_ast, node.comparators)
+            for comparator in node.comparators:
+                ChoiceExpr.sanitize_ast(comparator)
         elif isinstance(node, ast.UnaryOp):
             ChoiceExpr.sanitize_ast(node.operand)
         elif isinstance(node, ast.BinOp):
@@ -92,27 +104,37 @@ class ChoiceExpr:
             ChoiceExpr.sanitize_ast(node.test)
             ChoiceExpr.sanitize_ast(node.body)
             ChoiceExpr.sanitize_ast(node.orelse)
+        elif isinstance(node, (ast.Tuple, ast.List, ast.Set)):
+            # literal collections of constants, e.g. Model in ("V4", "V5")
+            for element in node.elts:
+                if type(element) is not ast.Constant:
+                    raise AttributeError(f"Unsupported expression type: {element}")
         elif type(node) in {ast.Name, ast.Constant}:
             return
         else:
             raise AttributeError(f"Unsupported expression type: {node}")
 
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def compile(expr: str):
+        """Parse, sanitize and compile an expression, once per expression
+        string. Returns the code object and the variables of the expression"""
+        tree = ast.parse(expr, mode="eval")
+        ChoiceExpr.sanitize_ast(tree)
+        return (
+            compile(tree, "<ChoiceExpr>", "eval"),
+            ChoiceExpr.extract_ast_vars(tree),
+        )
+
     def eval(self, user_choices: UserChoices):
-        # sanitize expression string
-        ChoiceExpr.sanitize_ast(ast.parse(self.expr, mode="eval"))
-        # extract dict items into assignment
-        # as scope context for evaluating expr
-        scope = "(lambda "
-        for key, value in user_choices.choices.items():
-            if isinstance(value, str):
-                value = f"'{value}'"
-            scope += f"{key} = {value}, "
-        scope = scope[0:-2] + f": {self.expr})()"
-        return eval(scope)  # WARNING: huge security risk
+        # the choices are the local variables of the expression, which can
+        # only reach names, no builtins (see sanitize_ast)
+        code, _ = ChoiceExpr.compile(self.expr)
+        return eval(code, _NO_BUILTINS, user_choices.choices)
 
     def vars(self):
         """Returns the variables in the expression"""
-        return ChoiceExpr.extract_ast_vars(ast.parse(self.expr, mode="eval"))
+        return list(ChoiceExpr.compile(self.expr)[1])
 
     @classmethod
     def from_dict(cls, s):
@@ -223,6 +245,78 @@ class ScaleEffect(ChoiceEffect):
         }
 
 
+class EffectTable:
+    """Decision table of the choice effects of many parts.
+
+    The distinct conditions of all effects are compiled into one expression
+    evaluating to a tuple, so applying user choices evaluates every
+    condition once. Parts with the same defaults and effects share a row
+    of the table. The results only depend on the user choices and the
+    defaults, not on choices applied before.
+    """
+
+    def __init__(self, parts):
+        """
+        :param parts: list of (effects, defaults) for every part, where
+                      defaults is (selected, count, scale)
+        """
+        conditions = {}  # expression -> index in the evaluated tuple
+        rows = {}  # (defaults, actions) -> row index
+        self.part_rows = []
+        for effects, defaults in parts:
+            actions = tuple(
+                (
+                    conditions.setdefault(effect.cond.expr, len(conditions)),
+                    EffectTable._action(effect),
+                )
+                for effect in effects
+            )
+            self.part_rows.append(rows.setdefault((defaults, actions), len(rows)))
+        self.rows = list(rows)
+        self.conditions = list(conditions)
+
+        bodies = []
+        for expr in conditions:
+            ChoiceExpr.compile(expr)  # sanitize
+            bodies.append(ast.parse(expr, mode="eval").body)
+        tree = ast.fix_missing_locations(ast.Expression(ast.Tuple(bodies, ast.Load())))
+        self.code = compile(tree, "<EffectTable>", "eval")
+
+    @staticmethod
+    def _action(effect):
+        if isinstance(effect, SelectionEffect):
+            return ("selected", None)
+        elif isinstance(effect, RelativeCountEffect):
+            return ("count_delta", effect.count_delta)
+        elif isinstance(effect, AbsoluteCountEffect):
+            return ("count", effect.count)
+        elif isinstance(effect, ScaleEffect):
+            return ("scale", effect.scale)
+        raise SyntaxError(f"Unknown ChoiceEffect {effect}")
+
+    def evaluate(self, user_choices: UserChoices):
+        """Apply the effects in order to the defaults of every part,
+        returns a list of (selected, count, scale) in the order of the parts
+        """
+        results = eval(self.code, _NO_BUILTINS, user_choices.choices)
+        outcomes = []
+        for (selected, count, scale), actions in self.rows:
+            for index, (kind, value) in actions:
+                result = results[index]
+                if kind == "selected":
+                    selected = result
+                elif not result:
+                    continue
+                elif kind == "count_delta":
+                    count += value
+                elif kind == "count":
+                    count = value
+                else:
+                    scale = value
+            outcomes.append((selected, count, scale))
+        return [outcomes[row] for row in self.part_rows]
+
+
 class Chooser:
     """Base class for a choice. This also corresponds to the UI shown for
     a choice"""
@@ -363,39 +457,124 @@ class Choices:
 
     def validate(self, user_choices: UserChoices):
         """Test validity of user choices input"""
-        avail_choices_dict = self.to_simple_dict()
-        valid_user_choices = UserChoices(dict())
-        for key, val in user_choices.choices.items():
+        order, index = self._sorted()
+        for key in user_choices.choices:
             # test valid option
-            if key not in avail_choices_dict:
+            if key not in index:
                 raise AttributeError(f"Unidentified option key '{key}'")
+
+        # preconditions see the choices they depend on, whatever the order
+        # of the user choices
+        valid_user_choices = UserChoices(dict())
+        for chooser in order:
+            key = chooser.varname
+            if key not in user_choices.choices:
+                continue
+            val = user_choices.choices[key]
             val_set = set(val) if type(val) is list or type(val) is set else {val}
-            if not val_set <= avail_choices_dict[key]:
+            values = index[key][1]
+            if not val_set <= values.keys():
                 raise AttributeError(f"Unidentified options '{val}' in '{key}'")
 
             # test valid precondition
             valid_user_choices.choices[key] = val
-            # get the chooser we just corresponding to the new user choice key val pair
-            chooser = next(
-                filter(
-                    lambda ch, key=key: ch.varname == key,
-                    self.choices,
-                )
-            )
-            # get the set of values that appeared in the user choice
-            values = (
-                {chooser.sel_value, chooser.unsel_value}
-                if type(chooser) is BooleanChooser
-                else set(chooser.values)
-            )
-            values = filter(lambda v, val=val: v.value in val, values)
             # test if all preconditions for values in such set are satisfied
-            for value in values:
+            for value in map(values.get, val_set):
                 if value.cond is not None and not value.cond.eval(valid_user_choices):
                     raise AttributeError(
                         f"Precondition for '{value.value}' not satisfied"
                     )
 
+    def configurations(self):
+        """Generate all valid user choices, lazily. The choosers are
+        walked in topological order and values whose precondition fails
+        prune the configurations below them. Every chooser gets a value,
+        a set of values (possibly empty) for MultiChoosers"""
+        order = self.toposort()
+        assigned = dict()
+
+        def walk(level):
+            if level == len(order):
+                yield UserChoices(dict(assigned))
+                return
+            chooser = order[level]
+            for _ in Choices._options(chooser, assigned):
+                yield from walk(level + 1)
+            assigned.pop(chooser.varname, None)
+
+        return walk(0)
+
+    def count(self) -> int:
+        """Number of valid user choices, see configurations. Counts of the
+        same remaining choosers are shared between configurations that agree
+        on the choices their preconditions use, so spaces too large to
+        list are counted quickly"""
+        order = self.toposort()
+        # variables used by the preconditions at each level and below
+        used = [set() for _ in range(len(order) + 1)]
+        for level in reversed(range(len(order))):
+            used[level] = used[level + 1].union(
+                *(v.cond.vars() for v in Choices._values(order[level]) if v.cond)
+            )
+        assigned = dict()
+        counts = dict()
+
+        def count(level):
+            if level == len(order):
+                return 1
+            key = (level,) + tuple(
+                (name, Choices._freeze(assigned[name]))
+                for name in sorted(used[level])
+                if name in assigned
+            )
+            if key not in counts:
+                chooser = order[level]
+                counts[key] = sum(
+                    count(level + 1) for _ in Choices._options(chooser, assigned)
+                )
+                assigned.pop(chooser.varname, None)
+            return counts[key]
+
+        return count(0)
+
+    @staticmethod
+    def _values(chooser: Chooser) -> [ChoiceValue]:
+        if type(chooser) is BooleanChooser:
+            return [v for v in (chooser.sel_value, chooser.unsel_value) if v]
+        return chooser.values
+
+    @staticmethod
+    def _freeze(value):
+        return frozenset(value) if type(value) is set else value
+
+    @staticmethod
+    def _options(chooser: Chooser, assigned: dict):
+        """Assign every valid value of a chooser in turn, given the values
+        of the choosers before it (as validate, a precondition sees the
+        value of its own chooser)"""
+        scope = UserChoices(assigned)
+        values = Choices._values(chooser)
+        if type(chooser) is MultiChooser:
+            # values whose precondition fails whatever else is selected
+            assigned.pop(chooser.varname, None)
+            values = [
+                v
+                for v in values
+                if v.cond is None
+                or chooser.varname in v.cond.vars()
+                or v.cond.eval(scope)
+            ]
+            for size in range(len(values) + 1):
+                for subset in itertools.combinations(values, size):
+                    assigned[chooser.varname] = {v.value for v in subset}
+                    if all(v.cond is None or v.cond.eval(scope) for v in subset):
+                        yield assigned[chooser.varname]
+        else:
+            for v in values:
+                assigned[chooser.varname] = v.value
+                if v.cond is None or v.cond.eval(scope):
+                    yield v.value
+
     def to_simple_dict(self) -> Dict[str, set]:
         """Serialize available choices as dict,
         preserving only varname -> value, i.e. no text and cond,
@@ -416,13 +595,48 @@ class Choices:
     def from_dict(cls, d):
         return cls([Chooser.gettype(c["type"]).from_dict(c) for c in d])
 
-    def toposort(self):
-        # returns a topological ordering of choices
-        # for choices at the same level, return choices in the order that they
-        # were passed in choices
-
-        # each level of choices depends on choices made in the previous levels
-
-        # circular dependencies are prohibited
-        # TODO: make this real toposort
-        return self.choices
+    def toposort(self) -> [Chooser]:
+        """Returns a topological ordering of choices: a chooser comes after
+        the choosers its values' preconditions depend on. Choices at the
+        same level are in the order they were passed in choices.
+        Circular dependencies raise ValueError"""
+        return self._sorted()[0]
+
+    def _sorted(self):
+        # the topological order and varname -> (chooser, value -> ChoiceValue)
+        # computed on every call as choosers are edited in place, sorting a
+        # few dozen choosers takes a fraction of a millisecond
+        index = {
+            c.varname: (c, {v.value: v for v in Choices._values(c)})
+            for c in self.choices
+        }
+        # Kahn's algorithm, level by level
+        dependents = {c.varname: [] for c in self.choices}
+        indegree = dict.fromkeys(dependents, 0)
+        for chooser in self.choices:
+            depends = set()
+            for value in Choices._values(chooser):
+                if value.cond is not None:
+                    depends.update(value.cond.vars())
+            depends.discard(chooser.varname)
+            for name in depends & index.keys():
+                dependents[name].append(chooser.varname)
+                indegree[chooser.varname] += 1
+
+        position = {c.varname: i for i, c in enumerate(self.choices)}
+        order = []
+        level = [c.varname for c in self.choices if indegree[c.varname] == 0]
+        while level:
+            order += level
+            ready = []
+            for name in level:
+                for dependent in dependents[name]:
+                    indegree[dependent] -= 1
+                    if indegree[dependent] == 0:
+                        ready.append(dependent)
+            level = sorted(ready, key=position.get)
+        if len(order) < len(self.choices):
+            circular = [c.varname for c in self.choices if indegree[c.varname]]
+            raise ValueError(f"Circular dependency between choices {circular}")
+
+        return [index[name][0] for name in order], index
@@ -0,0 +1,196 @@
+# Bitset encoding of user choices
+#
+# The values of every chooser are a small finite set, so a configuration
+# (a UserChoices) is a set of bits, one bit per varname and value, stored
+# in NumPy uint64 words. Many configurations are an (n, words) array.
+# Every chooser must have a choice, as in Choices.configurations: a
+# missing choice would have no bits, so 'Var != ...' would hold where
+# ChoiceExpr.eval raises NameError.
+#
+# Conditions of the forms used by choice values and effects are lowered to
+# predicates on such arrays:
+#   Var == 'v', Var != 'v'             single and boolean choosers
+#   Var in ('a', 'b'), Var not in (...)  single and boolean choosers
+#   'v' in Var, 'v' not in Var         multi choosers
+#   and, or, not, True, False
+# Every comparison is a test of the bits of a mask, so a condition is
+# evaluated for all configurations at once. Other forms raise ValueError,
+# ChoiceExpr.eval evaluates them one configuration at a time.
+
+import ast
+from functools import reduce
+
+import numpy as np
+
+from . import (
+    BooleanChooser,
+    ChoiceExpr,
+    Choices,
+    EffectTable,
+    MultiChooser,
+    UserChoices,
+)
+
+WORD_BITS = 64
+
+
+def _chooser_values(chooser):
+    if isinstance(chooser, BooleanChooser):
+        return [chooser.sel_value.value, chooser.unsel_value.value]
+    return [v.value for v in chooser.values]
+
+
+class Encoding:
+    """Bit positions of the values of the available choices"""
+
+    def __init__(self, choices: Choices):
+        self.choosers = {c.varname: c for c in choices.choices}
+        self.bits = {}  # (varname, value) -> bit position
+        for chooser in choices.choices:
+            for value in _chooser_values(chooser):
+                self.bits.setdefault((chooser.varname, value), len(self.bits))
+        self.words = max(1, -(-len(self.bits) // WORD_BITS))
+        self._predicates = {}  # expression -> predicate
+
+    def mask(self, varname, values):
+        """
+        Mask of the bits of some values of a choice
+        :param varname: the variable of the chooser
+        :param values: iterable of values, unknown values have no bit
+        :return: NumPy uint64 array of self.words
+        """
+        if varname not in self.choosers:
+            raise AttributeError(f"Unidentified option key '{varname}'")
+        mask = np.zeros(self.words, dtype=np.uint64)
+        for value in values:
+            bit = self.bits.get((varname, value))
+            if bit is not None:
+                mask[bit // WORD_BITS] |= np.uint64(1) << np.uint64(bit % WORD_BITS)
+        return mask
+
+    def encode(self, user_choices: UserChoices):
+        """
+        Encode one configuration, every chooser must have a choice (an
+        empty set for a MultiChooser)
+        :return: NumPy uint64 array of self.words
+        """
+        missing = self.choosers.keys() - user_choices.choices.keys()
+        if missing:
+            raise AttributeError(f"No choice made for {sorted(missing)}")
+        config = np.zeros(self.words, dtype=np.uint64)
+        for key, val in user_choices.choices.items():
+            val_set = set(val) if type(val) is list or type(val) is set else {val}
+            unknown = {v for v in val_set if (key, v) not in self.bits}
+            if key not in self.choosers or unknown:
+                raise AttributeError(f"Unidentified options '{val}' in '{key}'")
+            config |= self.mask(key, val_set)
+        return config
+
+    def encode_many(self, configurations):
+        """
+        Encode configurations
+        :param configurations: iterable of UserChoices
+        :return: NumPy uint64 array (n, self.words)
+        """
+        configs = [self.encode(c) for c in configurations]
+        if not configs:
+            return np.zeros((0, self.words), dtype=np.uint64)
+        return np.stack(configs)
+
+    def lower(self, expr: ChoiceExpr):
+        """
+        Lower a condition to a predicate on encoded configurations
+        :param expr: ChoiceExpr or expression string
+        :return: function of an (n, self.words) array returning n bools
+        """
+        expr = expr.expr if isinstance(expr, ChoiceExpr) else expr
+        if expr not in self._predicates:
+            ChoiceExpr.compile(expr)  # sanitize
+            tree = ast.parse(expr, mode="eval")
+            self._predicates[expr] = self._lower(tree.body, expr)
+        return self._predicates[expr]
+
+    def evaluate(self, expr: ChoiceExpr, configs):
+        """Evaluate a condition for all encoded configurations, returns a
+        NumPy bool array"""
+        return self.lower(expr)(configs)
+
+    def evaluate_table(self, table: EffectTable, configs):
+        """
+        Apply an EffectTable to all encoded configurations
+        :param table: choices.EffectTable
+        :param configs: NumPy uint64 array (n, self.words)
+        :return: NumPy arrays selected, count and scale, (n, parts) each
+        """
+        results = [self.evaluate(expr, configs) for expr in table.conditions]
+        n = len(configs)
+        outcomes = []
+        for (selected, count, scale), actions in table.rows:
+            selected = np.full(n, bool(selected))
+            count = np.full(n, count)
+            scale = np.full(n, scale, dtype=np.float64)
+            for index, (kind, value) in actions:
+                result = results[index]
+                if kind == "selected":
+                    selected = result
+                elif kind == "count_delta":
+                    count = count + np.where(result, value, 0)
+                elif kind == "count":
+                    count = np.where(result, value, count)
+                else:
+                    scale = np.where(result, value, scale)
+            outcomes.append((selected, count, scale))
+
+        if not outcomes:
+            empty = np.zeros((n, 0))
+            return empty.astype(bool), empty.astype(int), empty
+        part_rows = np.asarray(table.part_rows, dtype=np.intp)
+        return tuple(
+            np.stack(arrays, axis=1)[:, part_rows] for arrays in zip(*outcomes)
+        )
+
+    def _lower(self, node, expr):
+        if isinstance(node, ast.BoolOp):
+            operands = [self._lower(value, expr) for value in node.values]
+            op = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+            return lambda configs: reduce(op, (p(configs) for p in operands))
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            operand = self._lower(node.operand, expr)
+            return lambda configs: ~operand(configs)
+        if isinstance(node, ast.Constant) and isinstance(node.value, bool):
+            value = node.value
+            return lambda configs: np.full(len(configs), value)
+        if isinstance(node, ast.Compare) and len(node.ops) == 1:
+            mask, negate = self._compare(node.left, node.ops[0], node.comparators[0])
+            if mask is not None:
+                return lambda configs: (configs & mask).any(axis=1) != negate
+        raise ValueError(f"Cannot lower '{expr}' to bit operations")
+
+    def _compare(self, left, op, right):
+        # returns the mask and whether the test is negated, None if the
+        # comparison has no bitset form
+        negate = isinstance(op, (ast.NotEq, ast.NotIn))
+        if isinstance(op, (ast.Eq, ast.NotEq)):
+            if isinstance(left, ast.Constant):
+                left, right = right, left
+            if isinstance(left, ast.Name) and isinstance(right, ast.Constant):
+                if not self._single(left.id):
+                    return None, negate
+                return self.mask(left.id, [right.value]), negate
+        elif isinstance(op, (ast.In, ast.NotIn)):
+            if isinstance(left, ast.Constant) and isinstance(right, ast.Name):
+                if self._single(right.id):
+                    return None, negate
+                return self.mask(right.id, [left.value]), negate
+            if isinstance(left, ast.Name) and isinstance(
+                right, (ast.Tuple, ast.List, ast.Set)
+            ):
+                if not self._single(left.id):
+                    return None, negate
+                return self.mask(left.id, [e.value for e in right.elts]), negate
+        return None, negate
+
+    def _single(self, varname):
+        if varname not in self.choosers:
+            raise AttributeError(f"Unidentified option key '{varname}'")
+        return not isinstance(self.choosers[varname], MultiChooser)
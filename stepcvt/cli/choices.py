@@ -1,3 +1,5 @@
+import itertools
+import json
 import sys
 
 from stepcvt.choices import *
@@ -168,3 +170,20 @@ def choices_apply(project: Project, args):
     project.accept_user_choices(UserChoices(user_choices))
 
     return 1
+
+
+def choices_list(project: Project, args):
+    if args.count:
+        print(project.available_choices.count())
+        return 0
+    configurations = project.available_choices.configurations()
+    for user_choices in itertools.islice(configurations, args.limit):
+        print(
+            json.dumps(
+                {
+                    k: sorted(v) if type(v) is set else v
+                    for k, v in user_choices.choices.items()
+                }
+            )
+        )
+    return 0
@@ -20,13 +20,13 @@ def add_part(p, args):
     if args.all == True:  # add all parts
         if source.partinfo:  # not empty
             existing_ids = set([pi.part_id for pi in source.partinfo])
-            for partid, obj in source.parts():
+            for partid in source.part_ids():
                 if partid not in existing_ids:
-                    source.add_partinfo(partid, obj)
+                    source.add_partinfo(partid, None)
                     print(f"{partid} has been added to {source.name}")
         else:
-            for partid, obj in source.parts():
-                source.add_partinfo(partid, obj)
+            for partid in source.part_ids():
+                source.add_partinfo(partid, None)
                 print(f"{partid} has been added to {source.name}")
     else:
         ids = args.id  # parts that need to be added
@@ -37,12 +37,12 @@ def add_part(p, args):
         else:
             ids = set(ids)
             existing_ids = set([pi.part_id for pi in source.partinfo])
-            for partid, obj in source.parts():
+            for partid in source.part_ids():
                 if partid in ids:
                     if partid in existing_ids:
                         print(f"{partid} has already been added")
                     else:
-                        source.add_partinfo(partid, obj)
+                        source.add_partinfo(partid, None)
                         print(f"{partid} has been added to {source.name}")
     return 1
 
@@ -68,7 +68,7 @@ def edit_part(p, args):
     if args.count == None:
         raise NotImplementedError("Can only modify count for now")
 
-    all_ids = set([p[0] for p in source.parts()])
+    all_ids = set(source.part_ids())
     existing_ids = set([pi.part_id for pi in source.partinfo])
 
     if edit_id not in all_ids:
@@ -61,5 +61,5 @@ def list_parts(p, args):
         print(f"Listing parts of step file: {args.step_name}")
         for source in p.sources:
             if source.name == args.step_name:
-                for partid, _ in source.parts():
+                for partid in source.part_ids():
                     print(partid)
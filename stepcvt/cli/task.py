@@ -14,15 +14,21 @@ def stlconvert(p, args):
     else:
         rotation = [0, 0, 0]
 
+    # the adaptive modes pick their own tolerances unless they are given
+    if args.relativeTolerance or args.triangleBudget:
+        default = None
+    else:
+        default = 0.1
+
     if args.linearTolerance:
         linearTol = args.linearTolerance
     else:
-        linearTol = 0.1
+        linearTol = default
 
     if args.angularTolerance:
         angularTol = args.angularTolerance
     else:
-        angularTol = 0.1
+        angularTol = default
 
     for partinfo in source.partinfo:
         if partinfo.part_id == args.partID:
@@ -34,6 +40,8 @@ def stlconvert(p, args):
                             rotation=rotation,
                             linearTolerance=linearTol,
                             angularTolerance=angularTol,
+                            relativeTolerance=args.relativeTolerance,
+                            triangleBudget=args.triangleBudget,
                         )
             else:
                 # create new taskInfo object
@@ -42,6 +50,8 @@ def stlconvert(p, args):
                         rotation=rotation,
                         linearTolerance=linearTol,
                         angularTolerance=angularTol,
+                        relativeTolerance=args.relativeTolerance,
+                        triangleBudget=args.triangleBudget,
                     )
                 )
     return 1
@@ -0,0 +1,588 @@
+# Export engine for the parts of a project
+#
+# Every file to write is an ExportJob: the shape of a part, the STL
+# options of the part and the output filename. Jobs with the same shape
+# and options are only meshed once, the other files are copied (or
+# linked, see emit). Jobs of the same shape and tolerances share one
+# triangulation: rotation, scale and copies are applied to the vertices
+# of the mesh (see MeshedShape), not to the BRep.
+#
+# Meshed files are kept in a content addressed mesh cache: a job whose
+# shape and options were exported before is copied from the cache
+# instead of being meshed again (see mesh_key).
+#
+# With more than one worker the jobs are meshed in a process pool. The
+# workers receive the shapes as serialized BReps and return the status
+# and timings of each job. Every mesh is computed from scratch (existing
+# triangulations are removed first), so the files are identical to the
+# ones of a serial run.
+
+import hashlib
+import json
+import math
+import os
+import shutil
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import cadquery as cq
+import numpy as np
+from OCP.BRepMesh import BRepMesh_IncrementalMesh
+from OCP.BRepTools import BRepTools
+from OCP.StlAPI import StlAPI_Writer
+
+from . import instrumentation
+from .mesh import extract_mesh
+from .ocp_utils import (
+    bounding_box,
+    mesh_in_parallel,
+    deserialize,
+    geometry_buffer,
+    triangle_count,
+    occt_version,
+)
+from .progress import Progress, Cancelled, stop_pool
+from .utils import warn
+
+# tolerances of cadquery.exporters.export
+DEFAULT_TOLERANCE = 0.1
+DEFAULT_ANGULAR_TOLERANCE = 0.1
+
+# angular tolerance of the modes "relativeTolerance" and "triangleBudget"
+ADAPTIVE_ANGULAR_TOLERANCE = 0.5
+
+# gap between the copies of a part in one file
+DEFAULT_SPACING = 5.0
+
+# STL writers: StlAPI_Writer of OCCT or the NumPy writer of stepcvt.mesh,
+# both write identical files
+WRITERS = ("occt", "numpy")
+
+# how files with the same content are written, see emit()
+LINK_MODES = ("copy", "hardlink", "reflink")
+
+# ioctl of Linux to clone a file on copy-on-write file systems
+_FICLONE = 0x40049409
+
+# triangle budget search: first and finest deflection relative to the
+# size of the shape, maximal number of meshes, the fill of the budget to
+# aim for and the reduction of the deflection while the mesh is bounded
+BUDGET_START = 0.05
+BUDGET_FINEST = 1e-4
+BUDGET_STEP = 10
+BUDGET_TRIALS = 6
+BUDGET_FILL = 0.8
+
+# groups submitted ahead per worker process
+PIPELINE_DEPTH = 2
+
+# bump whenever the content of the meshed files changes
+MESH_CACHE_VERSION = 2
+
+
+class ExportJob:
+    """One STL file to write"""
+
+    __slots__ = ("part_id", "shape", "filename", "options")
+
+    def __init__(self, part_id, shape, filename, options=None):
+        """
+        :param part_id: id of the part
+        :param shape: cq.Shape
+        :param filename: name of the STL file
+        :param options: dict with the optional keys "scale", "rotation" (x, y, z
+                        angles in degrees), "tolerance", "angularTolerance",
+                        "relativeTolerance" (chordal error relative to the
+                        bounding box diagonal, replaces "tolerance"),
+                        "triangleBudget" (finest mesh with at most that many
+                        triangles, if the angular tolerance and the planar
+                        faces allow it) and "copies" (number of
+                        copies placed side by side in the file) with their
+                        "spacing"
+        """
+        self.part_id = part_id
+        self.shape = shape
+        self.filename = str(filename)
+        self.options = {} if options is None else options
+
+    def key(self):
+        """Jobs with the same key produce the same file content"""
+        return (id(self.shape), json.dumps(self.options, sort_keys=True))
+
+    def mesh_key(self):
+        """Jobs with the same mesh key share the triangulation"""
+        return (
+            id(self.shape),
+            self.options.get("tolerance"),
+            self.options.get("angularTolerance"),
+            self.options.get("relativeTolerance"),
+            self.options.get("triangleBudget"),
+        )
+
+
+def rotate(shape, rotation):
+    """
+    Rotate a shape around the x, then y, then z axis
+    :param shape: cq.Shape
+    :param rotation: angles in degrees
+    :return: cq.Shape
+    """
+    for i in range(3):
+        shape = shape.rotate(
+            (0, 0, 0),
+            # (1,0,0), (0,1,0), (0,0,1)
+            tuple(1 if n == i else 0 for n in range(3)),
+            rotation[i],
+        )
+    return shape
+
+
+def mesh_threads(threads=None, workers=1):
+    """
+    Number of threads meshing the faces of a shape in parallel: the
+    requested number, at most the cores left to each of the worker
+    processes, so that they do not compete for the cores
+    :param threads: requested threads, None or 0 for all cores left
+    :param workers: number of processes meshing at the same time
+    :return: int, 1 to mesh in the calling thread
+    """
+    cores = max(1, (os.cpu_count() or 1) // max(workers, 1))
+    if not threads:
+        return cores
+    return max(1, min(threads, cores))
+
+
+def transform_matrix(options):
+    """
+    The transformation of the export options as one matrix: scale, then
+    rotate around the x, then y, then z axis (as rotate does)
+    :param options: see ExportJob
+    :return: 3x3 NumPy array, None for the identity
+    """
+    scale = options.get("scale", 1.0)
+    rotation = options.get("rotation")
+    if scale == 1.0 and (rotation is None or not any(rotation)):
+        return None
+
+    matrix = np.eye(3) * scale
+    for axis, angle in enumerate(rotation or (0, 0, 0)):
+        c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+        i, j = [(1, 2), (2, 0), (0, 1)][axis]
+        r = np.eye(3)
+        r[i, i] = r[j, j] = c
+        r[i, j] = -s
+        r[j, i] = s
+        matrix = r @ matrix
+    return matrix
+
+
+class MeshedShape:
+    """
+    A shape meshed once with fixed tolerances, written with any transform
+    of the export options: rotation and scale are applied to the vertices
+    of the triangulation, no transformed copy of the BRep is meshed
+    """
+
+    def __init__(self, shape, options=None, part_id=None, threads=None):
+        """
+        :param shape: cq.Shape, its triangulation is replaced
+        :param options: see ExportJob, only the tolerances are used
+        :param part_id: id of the part, for the trace
+        :param threads: threads meshing the faces in parallel, see
+                        mesh_threads()
+        """
+        options = {} if options is None else options
+        self.shape = shape
+        self.threads = mesh_threads(threads)
+        self.budget = options.get("triangleBudget")
+        self.part_id = part_id
+        self.triangles = None
+        self._mesh = None
+
+        # the minimal deflection, relative to the edge sizes for "tolerance"
+        # or absolute, derived from the size of the shape
+        self.relative = True
+        self.deflection = options.get("tolerance") or DEFAULT_TOLERANCE
+        relative_tolerance = options.get("relativeTolerance")
+        if relative_tolerance or self.budget:
+            self.relative = False
+            self.deflection = (relative_tolerance or BUDGET_FINEST) * self.size()
+        # the angular tolerance would limit the adaptive modes
+        self.angular_tolerance = options.get("angularTolerance") or (
+            DEFAULT_ANGULAR_TOLERANCE if self.relative else ADAPTIVE_ANGULAR_TOLERANCE
+        )
+
+    def size(self):
+        """Length of the diagonal of the bounding box of the shape"""
+        bb = bounding_box(self.shape.wrapped)
+        return math.sqrt(bb.xsize**2 + bb.ysize**2 + bb.zsize**2)
+
+    def _mesh_at(self, deflection, relative):
+        # the result must not depend on meshes computed before
+        BRepTools.Clean_s(self.shape.wrapped)
+        BRepMesh_IncrementalMesh(
+            self.shape.wrapped,
+            deflection,
+            relative,
+            self.angular_tolerance,
+            mesh_in_parallel(self.threads),
+        )
+        return triangle_count(self.shape.wrapped)
+
+    def _fit(self):
+        # Search the finest deflection within the triangle budget, starting
+        # from a coarse (cheap) mesh. The number of triangles n follows about
+        # n ~ deflection ** -k, k is estimated from the last two trials
+        # (k = 1 for curved faces without other limits). Planar faces and the
+        # angular tolerance bound n from below, while n does not change the
+        # deflection is reduced in steps. The deflection is bounded by the
+        # minimal deflection.
+        target = self.budget * BUDGET_FILL
+        trials = {}  # deflection -> triangles
+        deflection = max(self.size() * BUDGET_START, self.deflection)
+        previous = None
+        for _ in range(BUDGET_TRIALS):
+            triangles = trials[deflection] = self._mesh_at(deflection, False)
+            meshed = deflection
+            instrumentation.count("mesh.trials")
+            if triangles <= self.budget and (
+                triangles >= target or deflection <= self.deflection
+            ):
+                break
+
+            if previous is None or previous[1] != triangles:
+                k = 1.0
+                if previous is not None:
+                    k = math.log(triangles / previous[1]) / math.log(
+                        previous[0] / deflection
+                    )
+                    k = min(max(k, 0.25), 4.0)
+                previous = (deflection, triangles)
+                deflection = deflection * (triangles / target) ** (1 / k)
+            elif triangles > self.budget:
+                # bounded from below, a coarser mesh does not help
+                break
+            else:
+                previous = (deflection, triangles)
+                deflection /= BUDGET_STEP
+
+            # stay between the finest fitting and the coarsest exceeding trial
+            finer = [d for d, n in trials.items() if n > self.budget]
+            coarser = [d for d, n in trials.items() if n <= self.budget]
+            if finer and coarser:
+                low, high = max(finer), min(coarser)
+                if not low < deflection < high:
+                    deflection = math.sqrt(low * high)
+            deflection = max(deflection, self.deflection)
+            if deflection in trials:
+                break
+
+        fitting = [d for d, n in trials.items() if n <= self.budget]
+        best = min(fitting) if fitting else max(trials)
+        if best != meshed:
+            self._mesh_at(best, False)
+        self.deflection = best
+        return trials[best]
+
+    def mesh(self):
+        """Mesh the shape, unless done before, return the time needed"""
+        if self.triangles is not None:
+            return 0.0
+        start = time.perf_counter()
+        with instrumentation.span("mesh", part=self.part_id):
+            if self.budget:
+                self.triangles = self._fit()
+            else:
+                self.triangles = self._mesh_at(self.deflection, self.relative)
+        instrumentation.count("triangles", self.triangles)
+        return time.perf_counter() - start
+
+    def extract(self):
+        """Return the triangulation as mesh.Mesh"""
+        if self._mesh is None:
+            self.mesh()
+            self._mesh = extract_mesh(self.shape.wrapped)
+        return self._mesh
+
+    def write(self, filename, options, writer="occt"):
+        """
+        Write the shape with the transform and copies of options
+        :param filename: name of the STL file
+        :param options: see ExportJob, the tolerances are ignored
+        :param writer: one of WRITERS
+        :return: dict with the number of triangles and the timings of the phases
+        """
+        timings = {"mesh": self.mesh()}
+        matrix = transform_matrix(options)
+        copies = options.get("copies", 1)
+
+        start = time.perf_counter()
+        mesh = None
+        if matrix is not None or copies > 1 or writer == "numpy":
+            with instrumentation.span("transform"):
+                mesh = self.extract()
+                if matrix is not None:
+                    mesh = mesh.transformed(matrix)
+                if copies > 1:
+                    # side by side along x
+                    mesh = mesh.copies(copies, options.get("spacing", DEFAULT_SPACING))
+        timings["transform"] = time.perf_counter() - start
+
+        # the file is replaced, never overwritten, it may be linked elsewhere
+        start = time.perf_counter()
+        with instrumentation.span("write", part=self.part_id):
+            tmp_file = f"{filename}.{os.getpid()}.tmp"
+            if mesh is not None:
+                mesh.write_stl(tmp_file)
+            else:
+                stl_writer = StlAPI_Writer()
+                stl_writer.ASCIIMode = False
+                if not stl_writer.Write(self.shape.wrapped, tmp_file):
+                    raise OSError(f"Cannot write {filename}")
+            os.replace(tmp_file, filename)
+        timings["write"] = time.perf_counter() - start
+
+        return {"triangles": self.triangles * copies, "seconds": timings}
+
+
+def write_stl(shape, filename, options, part_id=None, writer="occt", threads=None):
+    """
+    Mesh a shape and write it to an STL file
+    :param shape: cq.Shape, its triangulation is replaced
+    :param filename: name of the STL file
+    :param options: see ExportJob
+    :param part_id: id of the part, for the trace
+    :param writer: one of WRITERS
+    :param threads: threads meshing the faces in parallel, see mesh_threads()
+    :return: dict with the number of triangles and the timings of the phases
+    """
+    meshed = MeshedShape(shape, options, part_id, threads)
+    return meshed.write(filename, options, writer)
+
+
+def _write(meshed, filename, options, writer):
+    try:
+        result = meshed.write(filename, options, writer)
+        result["ok"] = True
+    except Exception as e:
+        result = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    return result
+
+
+def _run_group(part_id, shape, outputs, writer, threads):
+    # all outputs (filename, options) share the shape and tolerances
+    meshed = MeshedShape(shape, outputs[0][1], part_id, threads)
+    return [_write(meshed, filename, options, writer) for filename, options in outputs]
+
+
+def _run_serialized(part_id, buffer, outputs, writer, threads):
+    # runs in a worker process of export()
+    shape = cq.Shape.cast(deserialize(buffer))
+    return _run_group(part_id, shape, outputs, writer, threads)
+
+
+def mesh_key(buffer, options):
+    """
+    Key of the mesh cache: the BRep of the shape (without triangulation),
+    the export options and the OCCT version
+    :param buffer: BRep buffer from ocp_utils.geometry_buffer(shape)
+    :param options: see ExportJob
+    :return: str
+    """
+    key = hashlib.sha256(buffer)
+    key.update(json.dumps(options, sort_keys=True).encode("utf-8"))
+    key.update(f":{occt_version()}:{MESH_CACHE_VERSION}".encode("utf-8"))
+    return key.hexdigest()
+
+
+def emit(source, target, link="copy"):
+    """
+    Write the file target with the content of the file source
+    :param source: name of the source file
+    :param target: name of the target file
+    :param link: one of LINK_MODES. Hard links and reflinks fall back to a
+                 copy where the file system does not support them.
+    """
+    # an earlier export may have linked target to a cached file, writing
+    # through the link would change the cache
+    if os.path.lexists(target):
+        os.unlink(target)
+    if link == "copy":
+        shutil.copyfile(source, target)
+        return
+
+    try:
+        if link == "hardlink":
+            os.link(source, target)
+        else:
+            import fcntl
+
+            with open(source, "rb") as src, open(target, "wb") as dst:
+                fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+    except (ImportError, OSError):
+        shutil.copyfile(source, target)
+
+
+def _stl_triangles(filename):
+    # number of triangles in the header of a binary STL file
+    with open(filename, "rb") as fd:
+        fd.seek(80)
+        return struct.unpack("<I", fd.read(4))[0]
+
+
+def _store(cache_file, filename):
+    try:
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        shutil.copyfile(filename, tmp_file)
+        os.replace(tmp_file, cache_file)
+    except OSError as e:
+        warn(f"Cannot write mesh cache {cache_file}: {e}")
+
+
+def export(
+    jobs,
+    workers=1,
+    progress=None,
+    cache_dir=None,
+    link="copy",
+    writer="occt",
+    on_done=None,
+    threads=None,
+):
+    """
+    Write the STL files of all jobs
+    :param jobs: list of ExportJobs
+    :param workers: number of worker processes, 1 to mesh in this process
+    :param progress: progress.Progress, reports the phase "mesh"
+    :param cache_dir: directory of the mesh cache, None to always mesh
+    :param link: how files are written from the cache or from an identical
+                 job, see emit()
+    :param writer: STL writer, one of WRITERS
+    :param on_done: called with the index and the result of every job as
+                    soon as it is done, in the calling process
+    :param threads: threads meshing the faces of a part in parallel, in
+                    each worker, see mesh_threads()
+    :return: list with a result dict for every job (same order): "ok",
+             "error" if not ok, "triangles", "seconds" (per phase),
+             "cached" if the file came from the mesh cache and
+             "copied_from" for files copied from an identical job
+    """
+    if progress is None:
+        progress = Progress()
+    progress.start([("mesh", 1)])
+
+    first = {}  # job key -> index of the first job with that key
+    unique = []
+    duplicates = {}  # index of the first job -> indices of identical jobs
+    for i, job in enumerate(jobs):
+        source = first.setdefault(job.key(), i)
+        if source == i:
+            unique.append(i)
+        else:
+            duplicates.setdefault(source, []).append(i)
+
+    buffers = {}
+    if cache_dir is not None or workers > 1:
+        with instrumentation.span("fingerprint"):
+            for i in unique:
+                buffers[i] = geometry_buffer(jobs[i].shape.wrapped)
+
+    results = [None] * len(jobs)
+
+    def done(i, result):
+        results[i] = result
+        if result["ok"] and i in cache_files and not result.get("cached"):
+            _store(cache_files[i], jobs[i].filename)
+        if on_done is not None:
+            on_done(i, result)
+        for j in duplicates.get(i, []):
+            if result["ok"] and jobs[i].filename != jobs[j].filename:
+                emit(jobs[i].filename, jobs[j].filename, link)
+            done(j, dict(result, copied_from=jobs[i].filename))
+
+    cache_files = {}
+    pending = []
+    for i in unique:
+        if cache_dir is not None:
+            cache_files[i] = os.path.join(
+                cache_dir, f"{mesh_key(buffers[i], jobs[i].options)}.stl"
+            )
+            if os.path.exists(cache_files[i]):
+                emit(cache_files[i], jobs[i].filename, link)
+                instrumentation.count("mesh_cache.hit")
+                done(
+                    i,
+                    {
+                        "ok": True,
+                        "cached": True,
+                        "triangles": _stl_triangles(jobs[i].filename),
+                        "seconds": {},
+                    },
+                )
+                continue
+            instrumentation.count("mesh_cache.miss")
+        pending.append(i)
+
+    # jobs of the same shape and tolerances share one triangulation
+    groups = {}
+    for i in pending:
+        groups.setdefault(jobs[i].mesh_key(), []).append(i)
+    groups = list(groups.values())
+
+    def outputs(group):
+        return [(jobs[i].filename, jobs[i].options) for i in group]
+
+    workers = min(workers, len(groups))
+    threads = mesh_threads(threads, workers)
+    if workers <= 1:
+        for n, group in enumerate(groups):
+            progress.update("mesh", n / len(groups))
+            job = jobs[group[0]]
+            for i, result in zip(
+                group,
+                _run_group(job.part_id, job.shape, outputs(group), writer, threads),
+            ):
+                done(i, result)
+    else:
+        # only a few groups per worker are submitted ahead, so finished
+        # files do not pile up when on_done is slower than the workers
+        window = PIPELINE_DEPTH * workers
+        futures = {}
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+
+            def submit(n):
+                if n < len(groups):
+                    group = groups[n]
+                    futures[n] = pool.submit(
+                        _run_serialized,
+                        jobs[group[0]].part_id,
+                        buffers[group[0]],
+                        outputs(group),
+                        writer,
+                        threads,
+                    )
+
+            for n in range(window):
+                submit(n)
+            try:
+                for n, group in enumerate(groups):
+                    progress.update("mesh", n / len(groups))
+                    while not wait([futures[n]], timeout=0.1).done:
+                        progress.check()
+                    submit(n + window)
+                    for i, result in zip(group, futures.pop(n).result()):
+                        done(i, result)
+                    job = jobs[group[0]]
+                    instrumentation.count(
+                        "triangles",
+                        results[group[0]].get("triangles", 0)
+                        // job.options.get("copies", 1),
+                    )
+            except Cancelled:
+                stop_pool(pool)
+                raise
+
+    progress.update("mesh", 1.0)
+    return results
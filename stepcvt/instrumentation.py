@@ -0,0 +1,134 @@
+# Timing and counters of the phases of a run
+#
+# Code wraps its phases in spans and counts events:
+#
+#   with instrumentation.span("transfer"):
+#       reader.Transfer(doc)
+#   instrumentation.count("cache.hit")
+#
+# Nothing is recorded unless a Recorder is enabled, spans and counters
+# are cheap no-ops otherwise. A Recorder can summarize the run and write
+# it in the Chrome trace event format (chrome://tracing, Perfetto).
+# Only the calling process is recorded, worker processes of
+# Project.load are not.
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+
+
+class Recorder:
+    """Records spans and counters"""
+
+    def __init__(self):
+        self.spans = []  # (name, start, duration, thread id, args), in ns
+        self.counters = Counter()
+        self.origin = time.perf_counter_ns()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, /, **args):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter_ns() - start
+            with self._lock:
+                self.spans.append(
+                    (name, start - self.origin, duration, threading.get_ident(), args)
+                )
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def summary(self):
+        """
+        Return the number of calls and total time of every span name and
+        the counters
+        :return: dict {"spans": {name: {"calls": int, "seconds": float}},
+                       "counters": {name: int}}
+        """
+        spans = {}
+        for name, _, duration, _, _ in self.spans:
+            s = spans.setdefault(name, {"calls": 0, "seconds": 0.0})
+            s["calls"] += 1
+            s["seconds"] += duration / 1e9
+        return {"spans": spans, "counters": dict(self.counters)}
+
+    def trace(self):
+        """
+        Return the recording in the Chrome trace event format, the counters
+        are added as counter events at the end of the trace and as "counters"
+        :return: dict
+        """
+        pid = os.getpid()
+        events = [
+            {
+                "name": name,
+                "ph": "X",
+                "ts": start / 1e3,
+                "dur": duration / 1e3,
+                "pid": pid,
+                "tid": tid,
+                "args": args,
+            }
+            for name, start, duration, tid, args in self.spans
+        ]
+        end = (time.perf_counter_ns() - self.origin) / 1e3
+        events.extend(
+            {"name": name, "ph": "C", "ts": end, "pid": pid, "args": {name: value}}
+            for name, value in sorted(self.counters.items())
+        )
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "counters": dict(sorted(self.counters.items())),
+        }
+
+    def write(self, filename):
+        """Write the Chrome trace to a JSON file"""
+        with open(filename, "w") as fd:
+            json.dump(self.trace(), fd, indent=1)
+
+
+_recorder = None
+
+
+def enable():
+    """Start recording into a new Recorder and return it"""
+    global _recorder
+    _recorder = Recorder()
+    return _recorder
+
+
+def disable():
+    """Stop recording, return the Recorder used so far (or None)"""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def recorder():
+    """Return the active Recorder, None if not recording"""
+    return _recorder
+
+
+def enabled():
+    return _recorder is not None
+
+
+def span(name, /, **args):
+    """Context manager timing a phase, args are added to the trace event"""
+    if _recorder is None:
+        return contextlib.nullcontext()
+    return _recorder.span(name, **args)
+
+
+def count(name, n=1):
+    """Add n to a counter"""
+    if _recorder is not None:
+        _recorder.count(name, n)
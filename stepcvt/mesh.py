@@ -0,0 +1,166 @@
+# Triangle meshes of shapes as NumPy arrays
+#
+# extract_mesh collects the Poly_Triangulation of every face of a meshed
+# shape into one vertex and one triangle array, with the locations and
+# orientations of the faces applied. The binary STL written from it is
+# identical to the one of StlAPI_Writer: same header, same triangle
+# order and normals computed in double precision.
+#
+# OCP has no bulk accessor for the nodes and triangles of a
+# Poly_Triangulation, so extraction loops over them in Python. The
+# normals and the STL records are computed vectorized.
+
+import numpy as np
+from OCP.BRep import BRep_Tool
+from OCP.TopAbs import TopAbs_FACE, TopAbs_REVERSED
+from OCP.TopExp import TopExp_Explorer
+from OCP.TopLoc import TopLoc_Location
+from OCP.TopoDS import TopoDS
+
+STL_HEADER = b"STL Exported by Open CASCADE Technology [dev.opencascade.org]".ljust(
+    80, b"\0"
+)
+
+_STL_RECORD = np.dtype(
+    [("normal", "<f4", 3), ("vertices", "<f4", (3, 3)), ("attribute", "<u2")]
+)
+
+# gp::Resolution()
+_RESOLUTION = np.finfo(np.float64).tiny
+
+
+class Mesh:
+    """Triangle mesh, vertices (n, 3) float64 and triangles (m, 3) int64"""
+
+    __slots__ = ("vertices", "triangles")
+
+    def __init__(self, vertices, triangles):
+        self.vertices = vertices
+        self.triangles = triangles
+
+    def __len__(self):
+        return len(self.triangles)
+
+    def normals(self):
+        """Unit normals of all triangles, zero for degenerated triangles"""
+        points = self.vertices[self.triangles]
+        normals = np.cross(points[:, 1] - points[:, 0], points[:, 2] - points[:, 0])
+        lengths = np.linalg.norm(normals, axis=1)
+        valid = lengths > _RESOLUTION
+        normals[valid] /= lengths[valid, None]
+        normals[~valid] = 0
+        return normals
+
+    def transformed(self, matrix):
+        """
+        Return the mesh with a linear transformation applied to the vertices,
+        the triangles share the index array unless the winding is flipped
+        :param matrix: 3x3 NumPy array, a mirroring matrix flips the winding
+        :return: Mesh
+        """
+        triangles = self.triangles
+        if np.linalg.det(matrix) < 0:
+            triangles = triangles[:, [0, 2, 1]]
+        return Mesh(self.vertices @ matrix.T, triangles)
+
+    def copies(self, n, spacing):
+        """
+        Return n copies of the mesh side by side along the x axis
+        :param n: number of copies
+        :param spacing: gap between the bounding boxes of the copies
+        :return: Mesh
+        """
+        if not len(self.vertices):
+            return self
+        step = np.ptp(self.vertices[:, 0]) + spacing
+        offsets = np.zeros((n, 1, 3))
+        offsets[:, 0, 0] = np.arange(n) * step
+        vertices = (self.vertices[None] + offsets).reshape(-1, 3)
+        triangles = (
+            self.triangles[None] + (np.arange(n) * len(self.vertices))[:, None, None]
+        ).reshape(-1, 3)
+        return Mesh(vertices, triangles)
+
+    def welded(self):
+        """
+        Return the mesh with coincident vertices merged (faces share the
+        nodes of their edges only by position) and without the triangles
+        that collapse
+        :return: Mesh
+        """
+        vertices, inverse = np.unique(self.vertices, axis=0, return_inverse=True)
+        triangles = inverse.reshape(-1)[self.triangles]
+        valid = (
+            (triangles[:, 0] != triangles[:, 1])
+            & (triangles[:, 1] != triangles[:, 2])
+            & (triangles[:, 2] != triangles[:, 0])
+        )
+        return Mesh(vertices, triangles[valid])
+
+    def stl_bytes(self):
+        """The mesh as binary STL"""
+        records = np.zeros(len(self.triangles), dtype=_STL_RECORD)
+        records["normal"] = self.normals()
+        records["vertices"] = self.vertices[self.triangles]
+        return STL_HEADER + np.uint32(len(self.triangles)).tobytes() + records.tobytes()
+
+    def write_stl(self, filename):
+        """Write the mesh as binary STL with a single write"""
+        with open(filename, "wb") as fd:
+            fd.write(self.stl_bytes())
+
+
+def location_matrix(loc):
+    """
+    :param loc: TopLoc_Location
+    :return: 3x4 NumPy array of the transformation
+    """
+    trsf = loc.Transformation()
+    return np.array([[trsf.Value(r, c) for c in range(1, 5)] for r in range(1, 4)])
+
+
+def extract_mesh(shape):
+    """
+    Collect the triangulations of all faces of a meshed shape
+    :param shape: TopoDS_Shape
+    :return: Mesh
+    """
+    vertices = []
+    triangles = []
+    offset = 0
+    explorer = TopExp_Explorer(shape, TopAbs_FACE)
+    while explorer.More():
+        face = TopoDS.Face_s(explorer.Current())
+        loc = TopLoc_Location()
+        triangulation = BRep_Tool.Triangulation_s(face, loc)
+        if triangulation is not None:
+            nodes = np.array(
+                [
+                    triangulation.Node(i).Coord()
+                    for i in range(1, triangulation.NbNodes() + 1)
+                ],
+                dtype=np.float64,
+            ).reshape(-1, 3)
+            if not loc.IsIdentity():
+                matrix = location_matrix(loc)
+                nodes = nodes @ matrix[:, :3].T + matrix[:, 3]
+
+            faces = np.array(
+                [
+                    triangulation.Triangle(i).Get()
+                    for i in range(1, triangulation.NbTriangles() + 1)
+                ],
+                dtype=np.int64,
+            ).reshape(-1, 3)
+            faces += offset - 1
+            if face.Orientation() == TopAbs_REVERSED:
+                faces = faces[:, [0, 2, 1]]
+
+            vertices.append(nodes)
+            triangles.append(faces)
+            offset += len(nodes)
+        explorer.Next()
+
+    if not vertices:
+        return Mesh(np.zeros((0, 3)), np.zeros((0, 3), dtype=np.int64))
+    return Mesh(np.concatenate(vertices), np.concatenate(triangles))
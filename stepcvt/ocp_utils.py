@@ -16,6 +16,7 @@ from cadquery.occ_impl.shapes import downcast
 from .utils import distance
 from webcolors import hex_to_rgb
 
+import OCP
 from OCP.TopAbs import (
     TopAbs_EDGE,
     TopAbs_FACE,
@@ -23,8 +24,9 @@ from OCP.TopAbs import (
     TopAbs_WIRE,
     TopAbs_VERTEX,
 )
-from OCP.TopoDS import TopoDS_Compound, TopoDS_Shape, TopoDS_Edge
-from OCP.TopExp import TopExp_Explorer
+from OCP.TopoDS import TopoDS, TopoDS_Compound, TopoDS_Shape, TopoDS_Edge
+from OCP.TopExp import TopExp, TopExp_Explorer
+from OCP.TopTools import TopTools_IndexedMapOfShape
 
 from OCP.StlAPI import StlAPI_Writer
 
@@ -34,11 +36,13 @@ from OCP.TopLoc import TopLoc_Location
 
 # Bounding Box
 from OCP.TopoDS import TopoDS_Shape, TopoDS_Solid
-from OCP.BinTools import BinTools
+from OCP.BinTools import BinTools, BinTools_FormatVersion_CURRENT
 from OCP.Bnd import Bnd_Box
 from OCP.BRep import BRep_Tool
 from OCP.BRepBndLib import BRepBndLib
+from OCP.BRepBuilderAPI import BRepBuilderAPI_Copy
 from OCP.BRepMesh import BRepMesh_IncrementalMesh
+from OCP.OSD import OSD_ThreadPool
 from OCP.BRepTools import BRepTools
 from OCP.BRepGProp import BRepGProp
 from OCP.GProp import GProp_GProps
@@ -55,12 +59,19 @@ MAX_HASH_KEY = 2147483647
 #
 
 
+def hash_code(shape):
+    # OCCT 7.8 removed TopoDS_Shape.HashCode, the shapes are hashable instead
+    if hasattr(shape, "HashCode"):
+        return shape.HashCode(MAX_HASH_KEY)
+    return hash(shape)
+
+
 def make_key(objs, loc=None, optimal=False):  # pylint: disable=unused-argument
     # optimal is not used and as such ignored
     if not isinstance(objs, (tuple, list)):
         objs = [objs]
 
-    key = (tuple((s.HashCode(MAX_HASH_KEY) for s in objs)), loc_to_tq(loc))
+    key = (tuple((hash_code(s) for s in objs)), loc_to_tq(loc))
     return key
 
 
@@ -85,7 +96,8 @@ def occt_version():
         lib = glob(f"{os.environ['CONDA_PREFIX']}/lib/libTKBRep.*.*.*")[0]
         return lib.split(".so.")[-1]
     except:
-        return "(cannot retrieve Open CASCADE version)"
+        # outside of conda, fall back to the version of the OCP bindings
+        return getattr(OCP, "__version__", "(cannot retrieve Open CASCADE version)")
 
 
 #
@@ -291,11 +303,27 @@ def length(edge_or_wire):
 # Export STL
 
 
-def write_stl_file(compound, filename, tolerance=None, angular_tolerance=None):
+def mesh_in_parallel(threads):
+    """
+    Limit the threads of OCCT meshing the faces of a shape in parallel,
+    return whether to mesh in parallel (the isInParallel flag of
+    BRepMesh_IncrementalMesh)
+    """
+    if threads <= 1:
+        return False
+    OSD_ThreadPool.DefaultPool_s().SetNbDefaultThreadsToLaunch(threads)
+    return True
+
+
+def write_stl_file(
+    compound, filename, tolerance=None, angular_tolerance=None, threads=1
+):
     # Remove previous mesh data
     BRepTools.Clean_s(compound)
 
-    mesh = BRepMesh_IncrementalMesh(compound, tolerance, True, angular_tolerance)
+    mesh = BRepMesh_IncrementalMesh(
+        compound, tolerance, True, angular_tolerance, mesh_in_parallel(threads)
+    )
     mesh.Perform()
 
     writer = StlAPI_Writer()
@@ -307,25 +335,59 @@ def write_stl_file(compound, filename, tolerance=None, angular_tolerance=None):
     return result
 
 
+def triangle_count(shape):
+    """Number of triangles in the current triangulation of all faces of shape"""
+    count = 0
+    explorer = TopExp_Explorer(shape, TopAbs_FACE)
+    while explorer.More():
+        triangulation = BRep_Tool.Triangulation_s(
+            TopoDS.Face_s(explorer.Current()), TopLoc_Location()
+        )
+        if triangulation is not None:
+            count += triangulation.NbTriangles()
+        explorer.Next()
+    return count
+
+
 # OCP serialisation
 
 
-def serialize(shape):
+def serialize(shape, with_triangles=True):
     if shape is None:
         return None
 
+    # triangulations are written by default, as BinTools.Write_s does
+    args = () if with_triangles else (False, False, BinTools_FormatVersion_CURRENT)
     if platform.system() == "Darwin":
         with tempfile.NamedTemporaryFile() as tf:
-            BinTools.Write_s(shape, tf.name)
+            BinTools.Write_s(shape, tf.name, *args)
             with open(tf.name, "rb") as fd:
                 buffer = fd.read()
     else:
         bio = io.BytesIO()
-        BinTools.Write_s(shape, bio)
+        BinTools.Write_s(shape, bio, *args)
         buffer = bio.getvalue()
     return buffer
 
 
+def geometry_buffer(shape):
+    """
+    BRep buffer of a shape without triangulation, equal for equal geometry
+    whether or not the shape was meshed: meshing changes the flags of the
+    subshapes, so a copy with cleared flags is serialized
+    :param shape: TopoDS_Shape
+    :return: bytes
+    """
+    copy = BRepBuilderAPI_Copy(shape, True, False).Shape()
+    subshapes = TopTools_IndexedMapOfShape()
+    TopExp.MapShapes_s(copy, subshapes)
+    for i in range(1, subshapes.Extent() + 1):
+        subshape = subshapes.FindKey(i)
+        subshape.Modified(False)
+        subshape.Checked(False)
+    return serialize(copy, with_triangles=False)
+
+
 def deserialize(buffer):
     if buffer is None:
         return None
@@ -355,7 +417,7 @@ def _get_topo(shape, topo):
     hashes = {}
     while explorer.More():
         item = explorer.Current()
-        hash_value = item.HashCode(MAX_HASH_KEY)
+        hash_value = hash_code(item)
         if hashes.get(hash_value) is None:
             hashes[hash_value] = True
             yield downcast(item)
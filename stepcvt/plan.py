@@ -0,0 +1,221 @@
+# Export plans: what an export would do and what it would cost
+#
+# plan() resolves export jobs the way export.export does (identical jobs
+# are copied, jobs of one shape and tolerances share a mesh, meshes in
+# the mesh cache are not computed again) and estimates the triangles,
+# file size and meshing time of every file without meshing anything.
+#
+# The estimate follows the meshing criteria: a full circle is split into
+# segments of at most the angular tolerance and of the chord angle the
+# linear tolerance allows. Planar faces get about one triangle per node
+# on their boundary, curved faces a grid of segments over their parameter
+# range (BRepMesh splits each grid cell into about four triangles). The
+# numbers are good within a factor of two or three, enough to size
+# batches and worker pools.
+
+import math
+import os
+
+from OCP.BRep import BRep_Tool
+from OCP.BRepTools import BRepTools
+
+from . import export, instrumentation
+from .ocp_utils import geometry_buffer
+
+# meshing time, measured with BRepMesh on one core
+SECONDS_PER_TRIANGLE = 2e-5
+SECONDS_PER_FACE = 2e-3
+
+# binary STL: header and triangle count, one record per triangle
+STL_HEADER_BYTES = 84
+STL_TRIANGLE_BYTES = 50
+
+# surfaces curved in one direction, meshed with a few rows of triangles
+_SINGLE_CURVED = ("CYLINDER", "CONE", "EXTRUSION")
+_ROWS = 3
+
+# curves whose parameter is an angle
+_CONICS = ("CIRCLE", "ELLIPSE")
+
+
+def turn_segments(options):
+    """
+    Number of segments of a full circle the tolerances of the export
+    options allow
+    :param options: see export.ExportJob
+    :return: float
+    """
+    adaptive = options.get("relativeTolerance") or options.get("triangleBudget")
+    angular = options.get("angularTolerance") or (
+        export.ADAPTIVE_ANGULAR_TOLERANCE
+        if adaptive
+        else export.DEFAULT_ANGULAR_TOLERANCE
+    )
+    # deflection relative to the radius of curvature: the tolerance is
+    # relative to the size of the edges, the relative tolerance to the
+    # diagonal of the shape (about four times a typical radius)
+    if options.get("relativeTolerance"):
+        ratio = 4 * options["relativeTolerance"]
+    elif adaptive:
+        ratio = 4 * export.BUDGET_START
+    else:
+        ratio = options.get("tolerance") or export.DEFAULT_TOLERANCE
+    chord = 2 * math.acos(max(1 - ratio, -1.0))
+    return 2 * math.pi / min(angular, chord)
+
+
+def _edge_nodes(edge, segments):
+    kind = edge.geomType()
+    if kind == "LINE":
+        return 1
+    if kind in _CONICS:
+        first, last = BRep_Tool.Range_s(edge.wrapped)
+        return max(1.0, segments * abs(last - first) / (2 * math.pi))
+    return segments / 4
+
+
+def estimate_triangles(shape, options):
+    """
+    Estimate the number of triangles of a shape meshed with the tolerances
+    of the export options, copies not included
+    :param shape: cq.Shape
+    :param options: see export.ExportJob
+    :return: int
+    """
+    segments = turn_segments(options)
+    triangles = 0.0
+    for face in shape.Faces():
+        kind = face.geomType()
+        if kind == "PLANE":
+            nodes = sum(_edge_nodes(edge, segments) for edge in face.Edges())
+            triangles += max(2.0, nodes - 2)
+            continue
+        umin, umax, vmin, vmax = BRepTools.UVBounds_s(face.wrapped)
+        u = max(1.0, segments * (umax - umin) / (2 * math.pi))
+        if kind in _SINGLE_CURVED:
+            triangles += 2 * _ROWS * u
+        elif kind in ("SPHERE", "TORUS"):
+            v = max(1.0, segments * (vmax - vmin) / (2 * math.pi))
+            triangles += 4 * u * v
+        else:
+            # the parameters of free form surfaces are no angles
+            triangles += segments**2 / 4
+    triangles = int(triangles)
+
+    budget = options.get("triangleBudget")
+    if budget:
+        triangles = min(triangles, budget)
+    return triangles
+
+
+def plan(jobs, cache_dir=None):
+    """
+    Plan the export of jobs without meshing
+    :param jobs: list of export.ExportJobs
+    :param cache_dir: directory of the mesh cache, None if not used
+    :return: dict with "files", a dict for every job (same order) with
+             "part_id", "filename", "status" ("mesh", "shared" if the mesh
+             of another job is used, "cached" if the file is in the mesh
+             cache or "copy" for a file identical to an earlier one),
+             "faces", "edges", "triangles", "bytes" and meshing "seconds",
+             and "totals" with the sums, the number of "meshes", the
+             "longest" meshing time of a single mesh and the number of
+             "workers" beyond which the export cannot get faster
+    """
+    files = []
+    first = set()  # job keys
+    meshes = {}  # mesh key -> estimated triangles
+    meshed = set()  # mesh keys of the jobs with status "mesh"
+    stats = {}  # id(shape) -> (faces, edges)
+    buffers = {}  # id(shape) -> BRep, as for the mesh cache
+    for job in jobs:
+        shape_id = id(job.shape)
+        if shape_id not in stats:
+            stats[shape_id] = (len(job.shape.Faces()), len(job.shape.Edges()))
+        faces, edges = stats[shape_id]
+        copies = job.options.get("copies", 1)
+
+        def fingerprint():
+            if shape_id not in buffers:
+                buffers[shape_id] = geometry_buffer(job.shape.wrapped)
+            return buffers[shape_id]
+
+        if job.key() in first:
+            status = "copy"
+        elif cache_dir is not None and os.path.exists(
+            os.path.join(
+                cache_dir, export.mesh_key(fingerprint(), job.options) + ".stl"
+            )
+        ):
+            status = "cached"
+        elif job.mesh_key() in meshed:
+            # only meshes made by the export are shared, cached files and
+            # copies are not meshed
+            status = "shared"
+        else:
+            status = "mesh"
+            meshed.add(job.mesh_key())
+        first.add(job.key())
+
+        if job.mesh_key() not in meshes:
+            with instrumentation.span("estimate", part=job.part_id):
+                meshes[job.mesh_key()] = estimate_triangles(job.shape, job.options)
+        triangles = meshes[job.mesh_key()] * copies
+
+        seconds = 0.0
+        if status == "mesh":
+            seconds = (
+                meshes[job.mesh_key()] * SECONDS_PER_TRIANGLE + faces * SECONDS_PER_FACE
+            )
+        files.append(
+            {
+                "part_id": job.part_id,
+                "filename": job.filename,
+                "status": status,
+                "faces": faces,
+                "edges": edges,
+                "triangles": triangles,
+                "bytes": STL_HEADER_BYTES + STL_TRIANGLE_BYTES * triangles,
+                "seconds": seconds,
+            }
+        )
+
+    seconds = sum(f["seconds"] for f in files)
+    longest = max((f["seconds"] for f in files), default=0.0)
+    totals = {
+        "files": len(files),
+        "parts": len({f["part_id"] for f in files}),
+        "meshes": sum(f["status"] == "mesh" for f in files),
+        "cached": sum(f["status"] == "cached" for f in files),
+        "triangles": sum(f["triangles"] for f in files),
+        "bytes": sum(f["bytes"] for f in files),
+        "seconds": seconds,
+        "longest": longest,
+        "workers": max(1, math.ceil(seconds / longest)) if longest else 1,
+    }
+    return {"files": files, "totals": totals}
+
+
+def format_plan(p):
+    """
+    Format a plan as a table
+    :param p: result of plan()
+    :return: str
+    """
+    lines = [
+        f"{'part':<24} {'status':<7} {'faces':>6} {'triangles':>10} "
+        f"{'MB':>8} {'seconds':>8}"
+    ]
+    for f in p["files"]:
+        lines.append(
+            f"{f['part_id']:<24} {f['status']:<7} {f['faces']:>6} "
+            f"{f['triangles']:>10} {f['bytes'] / 1e6:>8.2f} {f['seconds']:>8.2f}"
+        )
+    t = p["totals"]
+    lines.append(
+        f"{t['files']} files of {t['parts']} parts, {t['meshes']} to mesh, "
+        f"{t['cached']} cached: about {t['triangles']} triangles, "
+        f"{t['bytes'] / 1e6:.1f} MB, {t['seconds']:.1f} s of meshing "
+        f"(longest mesh {t['longest']:.1f} s, at most {t['workers']} useful workers)"
+    )
+    return "\n".join(lines)
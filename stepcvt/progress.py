@@ -0,0 +1,136 @@
+# Progress reporting and cancellation for long running operations
+#
+# An operation (e.g. StepReader.load) consists of weighted phases. For
+# every phase the operation reports the fraction done so far to a
+# callback, together with the fraction of the whole operation:
+#
+#   callback(phase, fraction, total)
+#
+# OCP cannot subclass Message_ProgressIndicator, so the OCCT calls
+# (ReadFile, Transfer, BRepMesh_IncrementalMesh) are reported as a whole
+# and cancellation takes effect between them.
+
+import sys
+import threading
+import time
+
+
+class Cancelled(Exception):
+    """Raised when an operation is cancelled through its CancelToken"""
+
+
+class CancelToken:
+    """Thread safe flag to cancel an operation"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        """Raise Cancelled if the operation was cancelled"""
+        if self._event.is_set():
+            raise Cancelled()
+
+
+class Progress:
+    """Reports the progress of an operation to a callback"""
+
+    def __init__(self, callback=None, token=None):
+        """
+        :param callback: function(phase, fraction, total), None to only
+                         check for cancellation
+        :param token: CancelToken, None if the operation cannot be cancelled
+        """
+        self.callback = callback
+        self.token = token
+        self._phases = {}
+
+    def start(self, phases):
+        """
+        Start an operation
+        :param phases: list of (phase, weight), weights are relative
+        """
+        weights = sum(weight for _, weight in phases)
+        self._phases = {}
+        start = 0.0
+        for phase, weight in phases:
+            self._phases[phase] = (start, weight / weights)
+            start += weight / weights
+
+    def update(self, phase, fraction=0.0):
+        """
+        Report progress of a phase, raises Cancelled if the operation was
+        cancelled
+        :param phase: name of the phase
+        :param fraction: 0<=x<=1 of the phase
+        """
+        self.check()
+        if self.callback is None:
+            return
+        start, weight = self._phases.get(phase, (0.0, 0.0))
+        self.callback(phase, fraction, min(start + weight * fraction, 1.0))
+
+    def check(self):
+        if self.token is not None:
+            self.token.check()
+
+
+class PrintProgress:
+    """Callback printing the phases of an operation on one line"""
+
+    labels = {
+        "cache": "Loading from cache",
+        "read": "Reading STEP file",
+        "transfer": "transferring shapes",
+        "parse": "parsing Assembly",
+        "save": "saving to cache",
+        "load": "Loading STEP files",
+        "mesh": "meshing",
+    }
+
+    def __init__(self):
+        self.phase = None
+        self.start = time.time()
+
+    def __call__(self, phase, fraction, total):
+        if phase != self.phase and fraction < 1:
+            if self.phase is None:
+                self.start = time.time()
+            self.phase = phase
+            print(f"{self.labels.get(phase, phase)} ... ", flush=True, end="")
+        if total >= 1:
+            print("done")
+            print(f"duration: {time.time() - self.start:5.1f} s")
+            self.phase = None
+
+
+def stop_pool(pool):
+    """
+    Shut down a ProcessPoolExecutor without waiting for the jobs it is
+    running (when an operation was cancelled): queued jobs are cancelled
+    and the worker processes terminated
+    :param pool: concurrent.futures.ProcessPoolExecutor
+    """
+    # the pool has no public list of its workers
+    processes = list((pool._processes or {}).values())
+    if sys.version_info < (3, 9):
+        # no cancel_futures: the pool notices the terminated workers and
+        # fails the queued jobs with BrokenProcessPool
+        for process in processes:
+            process.terminate()
+        pool.shutdown()
+        return
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        process.terminate()
+
+
+def default_progress():
+    """Progress printing to stdout, as reported by the command line tools"""
+    return Progress(PrintProgress())
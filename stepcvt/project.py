@@ -5,9 +5,11 @@
 # part. Each PartInfo contains a set of information, each for a
 # specific task. Right now, only the STLConversionTask is specified.
 
+from concurrent.futures import ProcessPoolExecutor, wait
 from pathlib import Path, PurePath
 from typing import Type
-from stepcvt import stepreader, choices
+from stepcvt import stepreader, stepscan, choices, assemblycache, export, threemf
+from stepcvt.progress import Progress, Cancelled, default_progress, stop_pool
 import cadquery as cq
 import os
 
@@ -25,6 +27,7 @@ class Project:
             available_choices if available_choices is not None else choices.Choices([])
         )
         self.user_choices = choices.UserChoices(dict())
+        self._effect_table = None  # (effect rows, choices.EffectTable)
 
     def to_dict(self, root=None):
         s = []
@@ -48,9 +51,38 @@ class Project:
                     raise KeyError("Cannot add source that already exists")
         self.sources.append(CADSource.load_step_file(name, path))
 
-    def load(self, path):
-        for cs in self.sources:
-            cs.load()
+    def load(self, path, workers=1, geometry_only=False, progress=None):
+        """Load the STEP files of all sources. With workers > 1, the
+        files are parsed in parallel in a pool of worker processes.
+        geometry_only skips all color analysis (see StepReader.geometry_only).
+        progress (see stepcvt.progress) is passed to each source when
+        loading serially, otherwise it reports the phase "load" for the
+        whole project, None prints it (see progress.default_progress).
+        Cancelling terminates the workers."""
+        workers = min(workers, len(self.sources))
+        if workers <= 1:
+            for cs in self.sources:
+                cs.load(geometry_only=geometry_only, progress=progress)
+            return
+
+        if progress is None:
+            progress = default_progress()
+        progress.start([("load", 1)])
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(_read_source, str(cs.path), geometry_only)
+                for cs in self.sources
+            ]
+            try:
+                for i, (cs, future) in enumerate(zip(self.sources, futures)):
+                    progress.update("load", i / len(futures))
+                    while not wait([future], timeout=0.1).done:
+                        progress.check()
+                    cs.load(future.result(), geometry_only=geometry_only)
+                progress.update("load", 1.0)
+            except Cancelled:
+                stop_pool(pool)
+                raise
 
     @classmethod
     def from_dict(cls, d, root=None):
@@ -74,10 +106,51 @@ class Project:
         self.available_choices.validate(user_choices)
         self.user_choices = user_choices
 
-        # update dependent properties in partinfo
-        for sc in self.sources:
-            for info in sc.partinfo:
-                info.update_from_choices(self.user_choices)
+        # update dependent properties in partinfo, all at once
+        infos = [info for sc in self.sources for info in sc.partinfo]
+        outcomes = self.effect_table(infos).evaluate(self.user_choices)
+        for info, (selected, count, scale) in zip(infos, outcomes):
+            info.selected = selected
+            info.count = count
+            info.scale = scale
+
+    def effect_table(self, infos=None):
+        """
+        The choices.EffectTable of the choice effects of all parts. It is
+        built again when parts are added or removed or their effects or
+        defaults change
+        :param infos: list of all PartInfos of the project, if known
+        :return: choices.EffectTable, rows in the order of the parts
+        """
+        if infos is None:
+            infos = [info for sc in self.sources for info in sc.partinfo]
+        # as PartInfo.update_from_choices, effects compare by identity
+        rows = tuple(info.effect_row() for info in infos)
+        if self._effect_table is None or self._effect_table[0] != rows:
+            self._effect_table = (rows, choices.EffectTable(rows))
+        return self._effect_table[1]
+
+
+def _read_source(path, geometry_only=False):
+    # runs in a worker process of Project.load, the assemblies are sent
+    # back to the parent as serialized BRep buffers in the indexed cache
+    # format. Nothing is deserialized if the file is already cached. The
+    # default progress prints, a worker must stay silent as its stdout may
+    # be the output of the command.
+    sr = _step_reader(geometry_only)
+    sr.load(
+        path,
+        cache_dir=stepreader.DEFAULT_CACHE_DIR,
+        part_ids=(),
+        progress=Progress(),
+    )
+    return assemblycache.dumps(sr.assemblies)
+
+
+def _step_reader(geometry_only=False):
+    if geometry_only:
+        return stepreader.StepReader.geometry_only()
+    return stepreader.StepReader()
 
 
 class CADSource:
@@ -102,24 +175,45 @@ class CADSource:
 
         return partinfo
 
-    def parts(self, assemblies=None):
+    def parts(self, assemblies=None, unique=False):
         # TODO: handle repeated part_id
+        #
+        # with unique=True, every prototype (i.e. unique geometry) is
+        # only returned once, not once per occurrence in the assembly
         if assemblies is None:
             if self._CADSource__step != None:
                 assemblies = self._CADSource__step.assemblies
             else:
                 cs = CADSource.load_step_file(self.name, self.path)
                 assemblies = cs._CADSource__step.assemblies
-        return self._recursive_parts(assemblies)
-
-    def _recursive_parts(self, assemblies):
+        return self._recursive_parts(assemblies, seen=set() if unique else None)
+
+    def part_ids(self):
+        # part ids in the same order as parts(), but without building
+        # any geometry: if the STEP file is not loaded yet, only its
+        # product structure is scanned
+        if self._CADSource__step is None:
+            return stepscan.part_ids(str(self.path))
+        return stepscan.part_names(self._CADSource__step.assemblies)
+
+    def _recursive_parts(self, assemblies, part_ids=None, seen=None):
+        # only parts named in part_ids are returned (and deserialized
+        # if they were lazily loaded from a cache), all if it is None.
+        # Prototypes in seen are skipped, if it is not None.
         result = []
 
         for obj in assemblies:
-            if obj["shape"] is not None:
-                result.append((obj["name"], cq.Shape(obj["shape"])))
-            elif obj["shapes"] is not None:
-                result.extend(self._recursive_parts(obj["shapes"]))
+            if obj.shape is not None:
+                if part_ids is not None and obj.name not in part_ids:
+                    continue
+                if seen is not None and obj.proto is not None:
+                    if obj.proto in seen:
+                        continue
+                    seen.add(obj.proto)
+                shape = stepreader.resolve_shape(obj)
+                result.append((obj.name, cq.Shape(shape)))
+            elif obj.shapes is not None:
+                result.extend(self._recursive_parts(obj.shapes, part_ids, seen))
         return result
 
     @classmethod
@@ -128,7 +222,7 @@ class CADSource:
         # the loaded file can be a hidden attribute on CADSource
         cs = cls(name=name, path=path)
         sr = stepreader.StepReader()
-        sr.load(str(path))
+        sr.load(str(path), cache_dir=stepreader.DEFAULT_CACHE_DIR)
         cs._CADSource__step = sr
         return cs
 
@@ -164,13 +258,32 @@ class CADSource:
 
         return cls(name=d["name"], path=path, partinfo=partinfo)
 
-    def load(self):
-        sr = stepreader.StepReader()
-        sr.load(str(self.path))
+    def load(self, buffer=None, geometry_only=False, progress=None):
+        # buffer holds the assemblies in the indexed cache format if the
+        # file was already parsed elsewhere (see Project.load), progress
+        # is passed to StepReader.load
+        #
+        # only the shapes of parts in partinfo are deserialized when
+        # loading from a cache, and only the roots of the STEP file that
+        # contain them are transferred when parsing it
+        part_ids = {pi.part_id for pi in self.partinfo}
+        sr = _step_reader(geometry_only)
+        if buffer is not None:
+            sr.load_cache(assemblycache.AssemblyCache(buffer), part_ids)
+        else:
+            sr.load(
+                str(self.path),
+                cache_dir=stepreader.DEFAULT_CACHE_DIR,
+                part_ids=part_ids,
+                selective=True,
+                progress=progress,
+            )
         self._CADSource__step = sr
 
         # load _cad for partinfo
-        parts = {p: obj for (p, obj) in self.parts()}
+        parts = {
+            p: obj for (p, obj) in self._recursive_parts(sr.assemblies, part_ids, set())
+        }
         for pi in self.partinfo:
             pi._cad = parts[pi.part_id]
 
@@ -188,22 +301,45 @@ class TaskInfo:
 
 
 class STLConversionInfo(TaskInfo):
+    """
+    How a part is converted to stl. Instead of the linearTolerance the
+    deflection can be derived from the size of the part: relativeTolerance
+    is the chordal error relative to the diagonal of its bounding box,
+    triangleBudget the maximal number of triangles (see export.MeshedShape)
+    """
+
     rotation: None
     linearTolerance: float
     angularTolerance: float
+    relativeTolerance: float
+    triangleBudget: int
 
-    def __init__(self, rotation: None, linearTolerance: float, angularTolerance: float):
+    def __init__(
+        self,
+        rotation: None,
+        linearTolerance: float,
+        angularTolerance: float,
+        relativeTolerance: float = None,
+        triangleBudget: int = None,
+    ):
         self.rotation = rotation
         self.linearTolerance = linearTolerance
         self.angularTolerance = angularTolerance
+        self.relativeTolerance = relativeTolerance
+        self.triangleBudget = triangleBudget
 
     def to_dict(self):
-        return {
+        d = {
             "type": "STLConversionInfo",
             "rotation": self.rotation,
             "linearTolerance": self.linearTolerance,
             "angularTolerance": self.angularTolerance,
         }
+        if self.relativeTolerance is not None:
+            d["relativeTolerance"] = self.relativeTolerance
+        if self.triangleBudget is not None:
+            d["triangleBudget"] = self.triangleBudget
+        return d
 
     @classmethod
     def from_dict(cls, si_info):
@@ -211,21 +347,14 @@ class STLConversionInfo(TaskInfo):
             rotation=si_info.get("rotation"),
             linearTolerance=si_info.get("linearTolerance"),
             angularTolerance=si_info.get("angularTolerance"),
+            relativeTolerance=si_info.get("relativeTolerance"),
+            triangleBudget=si_info.get("triangleBudget"),
         )
         return x
 
     def rotate(self, part: cq.Shape) -> cq.Shape:
         """returns a rotated Cadquery Assembly object"""
-        # rotate takes two vector to form a rotational axis, then applies the rotation degree to that axis
-        # so has to make own x, y, z axis
-        for i in range(3):
-            part = part.rotate(
-                (0, 0, 0),
-                # (1,0,0), (0,1,0), (0,0,1)
-                tuple(1 if n == i else 0 for n in range(3)),
-                self.rotation[i],
-            )
-        return part
+        return export.rotate(part, self.rotation)
 
 
 class SlicerSettingsInfo(TaskInfo):
@@ -300,36 +429,71 @@ class PartInfo:
         self.choice_effects: [choices.ChoiceEffect] = (
             [] if choice_effect is None else choice_effect
         )
+        self._effect_table = None  # (effect_row, choices.EffectTable)
 
     def add_info(self, info: TaskInfo):
         """adds the provided info to the self.info list"""
         self.info.append(info)
 
-    def export_to_stl(self, stl_output: Path):
+    def stl_options(self):
         """
-        search partinfo for STLConversionInfo, if found
-        apply the STLConversionInfo transformations to the part
-        if not found, simply export the part to the stl_output specified.
+        Return the export options of the STLConversionInfo of the part
+        (see export.ExportJob), empty if it has none
         """
         stlinfo = next(
             (info for info in self.info if isinstance(info, STLConversionInfo)), None
         )
-
+        if stlinfo is None:
+            return {}
+        options = {
+            "rotation": stlinfo.rotation,
+            "tolerance": stlinfo.linearTolerance,
+            "angularTolerance": stlinfo.angularTolerance,
+        }
+        if stlinfo.relativeTolerance is not None:
+            options["relativeTolerance"] = stlinfo.relativeTolerance
+        if stlinfo.triangleBudget is not None:
+            options["triangleBudget"] = stlinfo.triangleBudget
+        return options
+
+    def shape(self) -> cq.Shape:
+        """returns the loaded part as a single shape"""
         if isinstance(self._cad, cq.Shape):
-            assem = self._cad
-        else:
-            assem = self._cad.toCompound()
-
-        if stlinfo is not None:
-            assem = stlinfo.rotate(assem)
-            cq.exporters.export(
-                assem,
-                str(stl_output),
-                tolerance=stlinfo.linearTolerance,
-                angularTolerance=stlinfo.angularTolerance,
-            )
-        else:
-            cq.exporters.export(assem, str(stl_output))
+            return self._cad
+        return self._cad.toCompound()
+
+    def export_job(self, stl_output: Path, copies: int = 1) -> export.ExportJob:
+        """
+        returns the export.ExportJob writing the part to stl_output,
+        with copies > 1 the file contains that many copies side by side
+        """
+        options = self.stl_options()
+        if self.scale != 1.0:
+            options["scale"] = self.scale
+        if copies > 1:
+            options["copies"] = copies
+        return export.ExportJob(self.part_id, self.shape(), stl_output, options)
+
+    def export_to_stl(self, stl_output: Path, progress: Progress = None):
+        """
+        search partinfo for STLConversionInfo, if found
+        apply the STLConversionInfo transformations to the part
+        if not found, simply export the part to the stl_output specified.
+        progress is checked for cancellation before meshing the part.
+        """
+        if progress is not None:
+            progress.check()
+        job = self.export_job(stl_output)
+        export.write_stl(job.shape, job.filename, job.options, job.part_id)
+
+    def export_to_3mf(self, output: Path, progress: Progress = None):
+        """
+        write the part to the 3MF file output, with its count as copies:
+        the mesh is stored once, each copy is a build item
+        """
+        threemf.write_3mf(
+            [self.export_job(output, copies=self.count)], output, progress
+        )
 
     @classmethod
     def from_part(cls, part_id: str, part):
@@ -394,9 +558,19 @@ class PartInfo:
             "choice_effect": [obj.to_dict() for obj in self.choice_effects],
         }
 
+    def effect_row(self):
+        """The choice effects and the defaults (selected, count, scale) of
+        the part, see choices.EffectTable"""
+        return tuple(self.choice_effects), (
+            self._default_selected,
+            self._default_count,
+            self._default_scale,
+        )
+
     def update_from_choices(self, user_choices: choices.UserChoices):
-        """Update dependent properties using provided UserChoices,
-        if None, then reset those properties to their default value.
+        """Update dependent properties using provided UserChoices, starting
+        from their default values, if None, then reset those properties to
+        their default value.
         Choices with conflicting value is undefined behaviour"""
         if user_choices is None:
             self.selected = self._default_selected
@@ -404,18 +578,11 @@ class PartInfo:
             self.scale = self._default_scale
             return
 
-        for effect in self.choice_effects:
-            result = effect.cond.eval(user_choices)
-            if isinstance(effect, choices.SelectionEffect):
-                self.selected = result
-                continue
-            if not result:
-                continue
-            if isinstance(effect, choices.RelativeCountEffect):
-                self.count += effect.count_delta
-            elif isinstance(effect, choices.AbsoluteCountEffect):
-                self.count = effect.count
-            elif isinstance(effect, choices.ScaleEffect):
-                self.scale = effect.scale
-            else:
-                raise SyntaxError(f"Unknown ChoiceEffect {effect}")
+        # the one-row table is compiled again only when an effect is added
+        # or removed or a default changes, effects compare by identity
+        row = self.effect_row()
+        if self._effect_table is None or self._effect_table[0] != row:
+            self._effect_table = (row, choices.EffectTable([row]))
+        ((self.selected, self.count, self.scale),) = self._effect_table[1].evaluate(
+            user_choices
+        )
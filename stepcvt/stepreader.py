@@ -1,14 +1,16 @@
+import glob
+import hashlib
 import os
-import pickle
-import time
 import unicodedata
 
 from OCP.STEPCAFControl import STEPCAFControl_Reader
-from OCP.TDF import TDF_LabelSequence, TDF_Label, TDF_ChildIterator
+from OCP.TDF import TDF_LabelSequence, TDF_Label, TDF_ChildIterator, TDF_Tool
 from OCP.TCollection import TCollection_ExtendedString
 from OCP.TDocStd import TDocStd_Document
 from OCP.XCAFDoc import (
     XCAFDoc_DocumentTool,
+    XCAFDoc_ShapeTool,
+    XCAFDoc_ColorTool,
     XCAFDoc_ColorSurf,
     XCAFDoc_ColorGen,
     XCAFDoc_ColorCurv,
@@ -20,13 +22,29 @@ from OCP.TopLoc import TopLoc_Location
 from OCP.TopAbs import TopAbs_SOLID, TopAbs_COMPOUND, TopAbs_COMPSOLID, TopAbs_FACE
 from OCP.TopExp import TopExp_Explorer
 
-from .ocp_utils import serialize, deserialize, loc_to_tq, tq_to_loc
+from . import assemblycache, instrumentation
+from .assemblycache import ShapeRef
+from .ocp_utils import tq_to_loc, occt_version
+from .progress import default_progress
 from .utils import warn
 
 import cadquery as cq
 
 DEFAULT_COLOR = (0.8, 0.8, 0.8, 1)
 
+# bump whenever the layout of the cached assemblies changes
+CACHE_VERSION = 3
+
+# directory of the automatic parse cache, set STEPCVT_CACHE_DIR to an
+# empty string to disable it
+DEFAULT_CACHE_DIR = (
+    os.environ.get(
+        "STEPCVT_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "stepcvt"),
+    )
+    or None
+)
+
 
 def clean_string(s):
     return (
@@ -38,6 +56,191 @@ def clean_string(s):
     )
 
 
+def file_digest(filename, chunk_size=1 << 20):
+    """
+    Compute the SHA-256 digest of a file's content
+    :param filename: name of the file
+    :param chunk_size: number of bytes hashed at a time
+    :return: str (hex digest)
+    """
+    h = hashlib.sha256()
+    with open(filename, "rb") as fd:
+        for chunk in iter(lambda: fd.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def label_entry(label):
+    """
+    Get the entry of a TDF_Label (e.g. "0:1:1:3"), which identifies the label in its document
+    :param label: TDF_label of a STEP file
+    :return: str
+    """
+    entry = TCollection_AsciiString()
+    TDF_Tool.Entry_s(label, entry)
+    return entry.ToCString()
+
+
+def resolve_shape(obj):
+    """
+    Return the shape of an AssemblyObject, deserializing it first if it
+    was loaded lazily from a cache
+    :param obj: AssemblyObject
+    :return: TopoDS_Shape
+    """
+    if isinstance(obj.shape, ShapeRef):
+        obj.shape = obj.shape.load()
+    return obj.shape
+
+
+class ShapeMap:
+    """Maps TopoDS_Shapes to values, shapes are the same key if they
+    share TShape and Location (TopoDS_Shape.IsSame), i.e. orientation is
+    ignored"""
+
+    def __init__(self):
+        self._buckets = {}
+        self._len = 0
+
+    def get(self, shape, default=None):
+        for s, value in self._buckets.get(hash(shape), ()):
+            if s.IsSame(shape):
+                return value
+        return default
+
+    def __setitem__(self, shape, value):
+        bucket = self._buckets.setdefault(hash(shape), [])
+        for i, (s, _) in enumerate(bucket):
+            if s.IsSame(shape):
+                bucket[i] = (shape, value)
+                return
+        bucket.append((shape, value))
+        self._len += 1
+
+    def __len__(self):
+        return self._len
+
+
+class AssemblyObject:
+    """
+    Node of an assembly tree. Nodes keep their fields in slots, large
+    trees therefore need far less memory than with one dict per node.
+    Item access (obj["name"]) is supported for code written against the
+    former dict nodes.
+    """
+
+    __slots__ = ("name", "loc", "color", "shape", "shapes", "proto")
+
+    def __init__(self, name, loc=None, color=None, shape=None, shapes=None, proto=None):
+        self.name = name
+        self.loc = loc
+        self.color = color
+        self.shape = shape
+        self.shapes = shapes
+        self.proto = proto
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def __repr__(self):
+        return f"AssemblyObject({self.name!r}, proto={self.proto!r})"
+
+
+class ColorIndex:
+    """
+    Colors of all shape and sub-shape labels of an XCAF document, read in
+    a single pass over the labels. Replaces per-shape ColorTool.GetColor
+    calls, each of which has to search the document for the shape.
+    """
+
+    def __init__(self, shape_tool):
+        self.colors = ShapeMap()
+        self.face_colors = ShapeMap()
+        self._effective = ShapeMap()
+
+        labels = TDF_LabelSequence()
+        shape_tool.GetShapes(labels)
+        for i in range(labels.Length()):
+            self._add_label(labels.Value(i + 1))
+
+    def _add_label(self, label):
+        color = self.label_color(label)
+        if color is not None:
+            shape = XCAFDoc_ShapeTool.GetShape_s(label)
+            self.colors[shape] = color
+            if shape.ShapeType() == TopAbs_FACE:
+                self.face_colors[shape] = color
+
+        sub_labels = TDF_LabelSequence()
+        XCAFDoc_ShapeTool.GetSubShapes_s(label, sub_labels)
+        for i in range(sub_labels.Length()):
+            self._add_label(sub_labels.Value(i + 1))
+
+    def label_color(self, label):
+        """
+        Get the color attached to a label (generic, surface or curve color)
+        :param label: TDF_Label
+        :return: 4 tuple (RGBA) or None
+        """
+        col = Quantity_ColorRGBA()
+        if (
+            XCAFDoc_ColorTool.GetColor_s(label, XCAFDoc_ColorGen, col)
+            or XCAFDoc_ColorTool.GetColor_s(label, XCAFDoc_ColorSurf, col)
+            or XCAFDoc_ColorTool.GetColor_s(label, XCAFDoc_ColorCurv, col)
+        ):
+            rgb = col.GetRGB()
+            return (rgb.Red(), rgb.Green(), rgb.Blue(), col.Alpha())
+        return None
+
+    def color(self, shape, analyse_faces=True):
+        """
+        Effective color of a shape, see StepReader.get_color
+        :param shape: TopoDS_Shape
+        :param analyse_faces: use the face colors if all faces have the same color
+        :return: 4 tuple (RGBA)
+        """
+        color = self._effective.get(shape)
+        if color is not None:
+            return color
+
+        shape_color = self.colors.get(shape)
+
+        colors = set()
+        # faces can only have a color of their own if there is a face label
+        if analyse_faces and len(self.face_colors) > 0:
+            exp = TopExp_Explorer(shape, TopAbs_FACE)
+            while exp.More():
+                face_color = self.face_colors.get(exp.Current())
+                if face_color is not None:
+                    colors.add(face_color)
+                exp.Next()
+
+        # If all faces have the same color, use this as shape color
+        if len(colors) == 1:
+            color = colors.pop()
+        else:
+            color = DEFAULT_COLOR if shape_color is None else shape_color
+
+        self._effective[shape] = color
+        return color
+
+
 class StepReader:
     def __init__(self, analyse_faces=True, split_compounds=True, use_colors=True):
         self.analyse_faces = analyse_faces
@@ -45,10 +248,28 @@ class StepReader:
         self.use_colors = use_colors
         self.shape_tool = None
         self.color_tool = None
+        self.color_index = None
         self.assemblies = None
+        # prototype id -> AssemblyObject (without location) of every
+        # referred label, shared by all occurrences of the label
+        self.prototypes = {}
+        # names of the top level objects that were not transferred by a
+        # selective load, see load()
+        self.unresolved = []
+
+    @classmethod
+    def geometry_only(cls):
+        """
+        Reader profile for callers that only need geometry (e.g. STL export):
+        no color analysis is done at all, all objects get DEFAULT_COLOR.
+        Colors are still read by OCCT since the XCAF label structure, and
+        thus the names of split compounds, depends on them.
+        :return: StepReader
+        """
+        return cls(analyse_faces=False, use_colors=False)
 
     def _create_assembly_object(
-        self, name, loc=None, color=None, shape=None, children=None
+        self, name, loc=None, color=None, shape=None, children=None, proto=None
     ):
         """
         Create a new object
@@ -57,15 +278,10 @@ class StepReader:
         :param color: 4 tuple (RGBA) with values 0<=x<=1
         :param shape: object shape (TopoDS_Shape)
         :param children: list of AssemblyObject objects
+        :param proto: id of the prototype in self.prototypes
         :return: AssemblyObject
         """
-        return {
-            "name": name,
-            "loc": loc,
-            "color": color,
-            "shape": shape,
-            "shapes": children,
-        }
+        return AssemblyObject(name, loc, color, shape, children, proto)
 
     def get_name(self, label):
         """
@@ -87,44 +303,14 @@ class StepReader:
         - if self.analyse_faces, get all colors of all faces. if all faces have the same color, return it, else return the shape color
         Note: This is BEST EFFORT only. Jupyter-CadQuery does not support different colors for the faces of a solid/compound.
               So for many STEP files with colored faces, the result will not be correct and depend on the structure of the STEP labels
+        Colors are looked up in self.color_index, which is built once per document.
         :param label: TDF_label or TopoDS_Shape of a STEP file
         :return: str
         """
-
-        def to_list(c):
-            return (c.GetRGB().Red(), c.GetRGB().Green(), c.GetRGB().Blue(), c.Alpha())
-
-        def get_col(obj):
-            col = Quantity_ColorRGBA()
-            if (
-                self.color_tool.GetColor(obj, XCAFDoc_ColorGen, col)
-                or self.color_tool.GetColor(obj, XCAFDoc_ColorSurf, col)
-                or self.color_tool.GetColor(obj, XCAFDoc_ColorCurv, col)
-            ):
-                return to_list(col)
-
         if not self.use_colors:
             return DEFAULT_COLOR
 
-        shape_color = get_col(shape)
-
-        colors = []
-        if self.analyse_faces:
-            # Find all face colors
-            exp = TopExp_Explorer(shape, TopAbs_FACE)
-            while exp.More():
-                color = get_col(exp.Current())
-                if color is not None:
-                    colors.append(color)
-                exp.Next()
-
-            colors = list(set(colors))
-
-        # If all faces have the same color, use this as shape color
-        if len(colors) == 1:
-            return colors[0]
-        else:
-            return DEFAULT_COLOR if shape_color is None else shape_color
+        return self.color_index.color(shape, self.analyse_faces)
 
     def get_location(self, label):
         """
@@ -159,7 +345,9 @@ class StepReader:
             if shape.ShapeType() == TopAbs_SOLID:
                 s_name = f"{name}_{i+1}"
                 color = self.get_color(shape)
-                sub_shape = self._create_assembly_object(s_name, loc, color, shape)
+                sub_shape = self._create_assembly_object(
+                    s_name, loc, color, shape, proto=label_entry(it.Value())
+                )
                 shapes.append(sub_shape)
                 i += 1
 
@@ -168,6 +356,7 @@ class StepReader:
 
             it.Next()
 
+        instrumentation.count("shapes", len(shapes))
         return shapes
 
     def get_subshapes(self, label=None, loc=None):
@@ -185,9 +374,21 @@ class StepReader:
             # get all sub-components of the label
             self.shape_tool.GetComponents_s(label, labels)
 
+        return self.get_occurrences(labels)
+
+    def get_occurrences(self, labels, progress=None):
+        """
+        Get the AssemblyObjects of a sequence of (reference) labels
+        :param labels: TDF_LabelSequence
+        :param progress: progress.Progress to report the "parse" phase to
+        :return: list of AssemblyObjects
+        """
         result = []
 
+        instrumentation.count("shapes", labels.Length())
         for i in range(labels.Length()):
+            if progress is not None:
+                progress.update("parse", i / labels.Length())
             sub_label = labels.Value(i + 1)
 
             if self.shape_tool.IsReference_s(sub_label):
@@ -196,92 +397,317 @@ class StepReader:
             else:
                 ref_label = sub_label
 
-            is_assembly = self.shape_tool.IsAssembly_s(ref_label)
-
-            # Get location from the sub_label and everything else from the referenced label
+            # Get location from the sub_label and everything else from the
+            # referenced label, which is only analysed once
             loc = self.get_location(sub_label)
-            name = self.get_name(ref_label)
-            shape = self.get_shape(ref_label)
-
-            sub_shape = self._create_assembly_object(name, loc)
-
-            if is_assembly:
-                sub_shape["shapes"] = self.get_subshapes(ref_label)
-
-            elif (
-                self.split_compounds
-                and shape.ShapeType() in [TopAbs_COMPOUND, TopAbs_COMPSOLID]
-                and ref_label.HasChild()
-            ):
-                sub_shapes = self.get_shape_details(ref_label, name, TopLoc_Location())
-                if len(sub_shapes) == 0:
-                    sub_shape["shape"] = shape
-                    sub_shape["color"] = self.get_color(shape)
-                else:
-                    sub_shape["shapes"] = sub_shapes
+            proto_id = self.get_prototype(ref_label)
+            proto = self.prototypes[proto_id]
+
+            sub_shape = self._create_assembly_object(
+                proto.name,
+                loc,
+                proto.color,
+                proto.shape,
+                proto.shapes,
+                proto_id,
+            )
+            result.append(sub_shape)
+
+        return result
+
+    def get_prototype(self, label):
+        """
+        Analyse a referred label (name, shape, color and sub shapes) and add it
+        to self.prototypes, unless this was already done for another reference
+        :param label: TDF_label of a STEP file
+        :return: prototype id (the entry of the label)
+        """
+        proto_id = label_entry(label)
+        if proto_id in self.prototypes:
+            return proto_id
+
+        name = self.get_name(label)
+        shape = self.get_shape(label)
 
+        proto = self._create_assembly_object(name, proto=proto_id)
+
+        if self.shape_tool.IsAssembly_s(label):
+            proto.shapes = self.get_subshapes(label)
+
+        elif (
+            self.split_compounds
+            and shape.ShapeType() in [TopAbs_COMPOUND, TopAbs_COMPSOLID]
+            and label.HasChild()
+        ):
+            sub_shapes = self.get_shape_details(label, name, TopLoc_Location())
+            if len(sub_shapes) == 0:
+                proto.shape = shape
+                proto.color = self.get_color(shape)
             else:
-                sub_shape["shape"] = shape
-                sub_shape["color"] = self.get_color(shape)
+                proto.shapes = sub_shapes
 
-            result.append(sub_shape)
+        else:
+            proto.shape = shape
+            proto.color = self.get_color(shape)
 
-        return result
+        self.prototypes[proto_id] = proto
+        return proto_id
 
-    def load(self, filename, cache_name=None, clear_cache=False):
+    def cache_key(self, filename):
+        """
+        Key identifying the parse result of a STEP file: the hash of the file
+        content combined with the reader flags and the OCCT version
+        :param filename: name of the STEP file
+        :return: str
+        """
+        key = ":".join(
+            str(k)
+            for k in (
+                file_digest(filename),
+                self.analyse_faces,
+                self.split_compounds,
+                self.use_colors,
+                occt_version(),
+                CACHE_VERSION,
+            )
+        )
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def load(
+        self,
+        filename,
+        cache_name=None,
+        clear_cache=False,
+        cache_dir=None,
+        part_ids=None,
+        selective=False,
+        progress=None,
+    ):
         """
         Load a STEP file
         The result will be stores as a list of AssemblyObjects in self.assemblies and
-        for faster reload saved in a pickle format with binary BRep buffers
+        for faster reload saved in an indexed cache format with binary BRep buffers
         :param filename: name of the STEP file
         :param cache_name: name of the binary cache object
         :param clear_cache: clear cache before loading to force analysis of STEP file
+        :param cache_dir: directory of the content addressed cache, used when no cache_name is given
+        :param part_ids: names of the parts whose shapes are needed, when loading from
+                         cache all other shapes are only deserialized by resolve_shape
+        :param selective: when parsing the STEP file, only transfer the roots that
+                          contain a part in part_ids. All other roots are added as
+                          unresolved placeholders (see self.unresolved) and the
+                          partial result is not cached.
+        :param progress: progress.Progress for the phases "cache" (when loading
+                         from cache) or "read", "transfer", "parse" and "save",
+                         None to print the phases
         """
-        start = time.time()
+        if progress is None:
+            progress = default_progress()
+
+        if cache_name is None and cache_dir is not None and os.path.exists(filename):
+            cache_name = os.path.join(cache_dir, self.cache_key(filename))
+
         if cache_name is not None:
             cache_filename = f"{cache_name}.jq"
-            if os.path.exists(cache_filename):
-                if clear_cache:
-                    os.unlink(cache_filename)
-                    print("Cache cleared")
-                else:
-                    print("Loading from cache ... ", flush=True, end="")
-                    self.load_assembly(cache_filename)
-                    print("done")
-                    print(f"duration: {time.time() - start:5.1f} s")
-                    return
+            if clear_cache:
+                partial = glob.glob(f"{glob.escape(cache_name)}.*.jq")
+                for name in [cache_filename] + partial:
+                    if os.path.exists(name):
+                        os.unlink(name)
+                        print("Cache cleared")
+            if self._load_cached(cache_filename, part_ids, progress):
+                return
+            instrumentation.count("cache.miss")
 
         if not os.path.exists(filename):
             raise FileNotFoundError(filename)
 
-        print("Reading STEP file ... ", flush=True, end="")
-        time.sleep(0.01)  # ensure output is shown
+        roots = None
+        if selective and part_ids is not None:
+            roots = self.select_roots(filename, part_ids)
+        if roots is not None and cache_name is not None:
+            # a selective load is cached for its set of roots
+            cache_filename = f"{cache_name}.{self.roots_key(roots)}.jq"
+            if self._load_cached(cache_filename, part_ids, progress):
+                self.unresolved = [node["name"] for node, needed in roots if not needed]
+                return
+
+        progress.start([("read", 4), ("transfer", 4), ("parse", 2), ("save", 1)])
+        progress.update("read")
+        reader, doc = self._read(filename)
+        if roots is not None and reader.NbRootsForTransfer() != len(roots):
+            # the reader lists the top level product definitions in file
+            # order, just like the scanner, unless they cannot be matched
+            roots = None
+        progress.update("read", 1.0)
+
+        self.prototypes = {}
+        self.unresolved = []
+        self.assemblies = None
+        if roots is not None:
+            self.assemblies = self.transfer_roots(reader, doc, roots, progress)
+            if self.assemblies is None:
+                warn(f"Cannot match the roots of {filename}, transferring all")
+                self.prototypes = {}
+                self.unresolved = []
+                # the reader cannot transfer the other roots anymore
+                reader, doc = self._read(filename)
+                cache_filename = f"{cache_name}.jq"
+        if self.assemblies is None:
+            progress.update("transfer")
+            with instrumentation.span("transfer"):
+                reader.Transfer(doc)
+            if self.use_colors:
+                with instrumentation.span("colors"):
+                    self.color_index = ColorIndex(self.shape_tool)
+            progress.update("transfer", 1.0)
+
+            progress.update("parse")
+            labels = TDF_LabelSequence()
+            self.shape_tool.GetFreeShapes(labels)
+            with instrumentation.span("parse"):
+                self.assemblies = self.get_occurrences(labels, progress)
+            progress.update("parse", 1.0)
 
+        if cache_name is not None:
+            progress.update("save")
+            try:
+                with instrumentation.span("cache.save"):
+                    self.save_assembly(cache_filename)
+            except OSError as e:
+                warn(f"Cannot write cache {cache_filename}: {e}")
+        # a skipped save is reported as done as well
+        progress.update("save", 1.0)
+
+    def _load_cached(self, cache_filename, part_ids, progress):
+        # load self.assemblies from a cache file, False if there is no
+        # valid one
+        if not os.path.exists(cache_filename):
+            return False
+        progress.start([("cache", 1)])
+        progress.update("cache")
+        try:
+            with instrumentation.span("cache.load"):
+                self.load_assembly(cache_filename, part_ids)
+        except ValueError as e:
+            warn(f"Ignoring cache {cache_filename}: {e}")
+            return False
+        instrumentation.count("cache.hit")
+        progress.update("cache", 1.0)
+        return True
+
+    def _read(self, filename):
+        # read a STEP file into a new document, returns (reader, document)
         fmt = TCollection_ExtendedString("CadQuery-XCAF")
         doc = TDocStd_Document(fmt)
 
         self.shape_tool = XCAFDoc_DocumentTool.ShapeTool_s(doc.Main())
         self.color_tool = XCAFDoc_DocumentTool.ColorTool_s(doc.Main())
+        self.color_index = None
 
         reader = STEPCAFControl_Reader()
         reader.SetNameMode(True)
         reader.SetColorMode(True)
         reader.SetLayerMode(True)
 
-        reader.ReadFile(filename)
-        reader.Transfer(doc)
+        with instrumentation.span("read", filename=filename):
+            reader.ReadFile(filename)
+        return reader, doc
 
-        print("parsing Assembly ... ", flush=True, end="")
+    def select_roots(self, filename, part_ids):
+        """
+        Find the roots of a STEP file that contain at least one of the
+        given parts, using the product structure from stepscan
+        :param filename: name of the STEP file
+        :param part_ids: names of the needed parts
+        :return: list of (scanned node, needed) per root, None if all roots
+                 are needed
+        """
+        from . import stepscan
+
+        nodes = stepscan.StepScanner(self.split_compounds).scan(filename)
+        part_ids = set(part_ids)
+        roots = [
+            (node, not part_ids.isdisjoint(stepscan.part_names([node])))
+            for node in nodes
+        ]
+        if all(needed for _, needed in roots):
+            return None
+        return roots
+
+    @staticmethod
+    def roots_key(roots):
+        """
+        Key of the set of needed roots, identifies the cache of a selective load
+        :param roots: list of (scanned node, needed) from select_roots
+        :return: str
+        """
+        needed = [i for i, (_, needed) in enumerate(roots) if needed]
+        return hashlib.sha256(repr(needed).encode("utf-8")).hexdigest()[:16]
 
-        self.assemblies = self.get_subshapes()
+    def transfer_roots(self, reader, doc, roots, progress):
+        """
+        Transfer the needed roots only and create placeholders for all others
+        :param reader: STEPCAFControl_Reader that has read the file
+        :param doc: TDocStd_Document to transfer to
+        :param roots: list of (scanned node, needed) from select_roots
+        :param progress: progress.Progress
+        :return: list of AssemblyObjects, None if the transferred roots do
+                 not match the scanned ones
+        """
+        from . import stepscan
 
-        print("done")
-        print(f"duration: {time.time() - start:5.1f} s")
+        labels = TDF_LabelSequence()
+        counts = []
+        for i, (_, needed) in enumerate(roots):
+            progress.update("transfer", i / len(roots))
+            if needed:
+                with instrumentation.span("transfer", root=i + 1):
+                    reader.TransferOneRoot(i + 1, doc)
+                # each root adds its own free shapes
+                self.shape_tool.GetFreeShapes(labels)
+                counts.append(labels.Length() - sum(counts))
+                labels.Clear()
+            else:
+                counts.append(0)
 
-        if cache_name is not None:
-            print("Saving to cache ... ", flush=True, end="")
-            self.save_assembly(cache_filename)
-            print("done")
+        if self.use_colors:
+            with instrumentation.span("colors"):
+                self.color_index = ColorIndex(self.shape_tool)
+        progress.update("transfer", 1.0)
+
+        progress.update("parse")
+        self.shape_tool.GetFreeShapes(labels)
+        with instrumentation.span("parse"):
+            transferred = iter(self.get_occurrences(labels, progress))
+
+        result = []
+        for (node, needed), count in zip(roots, counts):
+            if needed:
+                objs = [next(transferred) for _ in range(count)]
+                # a root is one free shape named like the scanned product,
+                # holding the parts the scan found in it
+                if [obj.name for obj in objs] != [node["name"]] or set(
+                    stepscan.part_names([node])
+                ) - set(stepscan.part_names(objs)):
+                    return None
+                result.extend(objs)
+            else:
+                result.append(self.placeholder(node))
+                self.unresolved.append(node["name"])
+        progress.update("parse", 1.0)
+        return result
+
+    def placeholder(self, node):
+        """
+        Create an AssemblyObject without shape for a scanned node (see stepscan)
+        :param node: scanned node
+        :return: AssemblyObject
+        """
+        children = node["shapes"]
+        if children is not None:
+            children = [self.placeholder(child) for child in children]
+        return self._create_assembly_object(node["name"], children=children)
 
     def to_cadquery(self, path=None):
         """
@@ -296,7 +722,7 @@ class StepReader:
             a = cq.Assembly(name=name, loc=loc)
             names = {}
             for obj in objs:
-                name = obj["name"]
+                name = obj.name
 
                 # Create a unique name by postfixing the enumerator index if needed
                 if names.get(name) is None:
@@ -306,35 +732,33 @@ class StepReader:
                 name = f"{obj['name']}_{names[name]}"
 
                 a.add(
-                    to_workplane(obj["shape"])
-                    if obj["shapes"] is None
-                    else walk(obj["shapes"]),
+                    to_workplane(resolve_shape(obj))
+                    if obj.shapes is None
+                    else walk(obj.shapes),
                     name=name,
-                    color=None if obj["color"] is None else cq.Color(*obj["color"]),
-                    loc=cq.Location(obj.get("loc")),
+                    color=None if obj.color is None else cq.Color(*obj.color),
+                    loc=cq.Location(obj.loc),
                 )
 
             return a
 
         if len(self.assemblies) == 0 or (
-            self.assemblies[0]["shapes"] is not None
-            and len(self.assemblies[0]["shapes"]) == 0
+            self.assemblies[0].shapes is not None
+            and len(self.assemblies[0].shapes) == 0
         ):
             raise ValueError("Empty assembly list")
 
         if len(self.assemblies) == 1:
             assembly = self.assemblies[0]
-            return walk(
-                assembly["shapes"], assembly["name"], cq.Location(assembly["loc"])
-            )
+            return walk(assembly.shapes, assembly.name, cq.Location(assembly.loc))
         else:
             result = cq.Assembly(name="Group")
             for assembly in self.assemblies:
                 result.add(
                     walk(
-                        assembly["shapes"],
-                        assembly["name"],
-                        cq.Location(assembly["loc"]),
+                        assembly.shapes,
+                        assembly.name,
+                        cq.Location(assembly.loc),
                     )
                 )
 
@@ -345,52 +769,89 @@ class StepReader:
 
     def save_assembly(self, filename):
         """
-        Cache the STEP file in a pickle file with binary BRep buffers
+        Cache the STEP file in the indexed cache format with binary BRep buffers
         :param filename: name of the cache object
         """
-
-        def _save_assembly(assemblies):
-            if assemblies is None:
-                return None
-
-            result = []
-            for assembly in assemblies:
-                obj = self._create_assembly_object(
-                    assembly["name"],
-                    loc_to_tq(assembly["loc"]),
-                    assembly["color"],
-                    serialize(assembly["shape"]),
-                    _save_assembly(assembly["shapes"]),
-                )
-                result.append(obj)
-            return result
-
-        objs = _save_assembly(self.assemblies)
-        with open(filename, "wb") as fd:
-            pickle.dump(objs, fd)
-
-    def load_assembly(self, filename):
+        dirname = os.path.dirname(filename)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+
+        # write to a temporary file first so that concurrent readers
+        # never see a partially written cache
+        tmp_filename = f"{filename}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_filename, "wb") as fd:
+                assemblycache.write(fd, self.assemblies)
+            os.replace(tmp_filename, filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.unlink(tmp_filename)
+
+    def load_assembly(self, filename, part_ids=None):
         """
-        Load the STEP file from a pickle file with binary BRep buffers.
+        Load the STEP file from an indexed cache file with binary BRep buffers.
         The result will be stores as a list of AssemblyObjects in self.assemblies
         :param filename: name of the cache object
+        :param part_ids: names of the parts to deserialize, all other shapes are
+                         left as ShapeRef until resolve_shape is called on them
         """
-
-        def _load_assembly(objs):
-            if objs is None:
-                return None
-
-            result = []
-            for obj in objs:
-                assembly = self._create_assembly_object(
-                    obj["name"],
-                    tq_to_loc(*obj["loc"]),
-                    obj["color"],
-                    deserialize(obj["shape"]),
-                    _load_assembly(obj["shapes"]),
+        cache = assemblycache.AssemblyCache.open(filename)
+        try:
+            self.load_cache(cache, part_ids)
+        finally:
+            if part_ids is None:
+                # every shape is deserialized, the file is no longer needed
+                cache.close()
+
+    def load_cache(self, cache, part_ids=None):
+        """
+        Build self.assemblies from an AssemblyCache
+        :param cache: AssemblyCache
+        :param part_ids: names of the parts to deserialize, None for all
+        """
+        roots = []
+        nodes = []
+        self.prototypes = {}
+        self.unresolved = []
+        for entry in cache.entries:
+            parent = None if entry["parent"] == -1 else nodes[entry["parent"]]
+            if parent is False:
+                # inside a repeated prototype, its objects are shared
+                nodes.append(False)
+                continue
+
+            t, q = entry["loc"]
+            loc = None if t is None else tq_to_loc(t, q)
+            proto_id = entry["proto"]
+            proto = self.prototypes.get(proto_id)
+            if proto is not None:
+                obj = self._create_assembly_object(
+                    proto.name,
+                    loc,
+                    proto.color,
+                    proto.shape,
+                    proto.shapes,
+                    proto_id,
+                )
+                nodes.append(obj if obj.shapes is None else False)
+            else:
+                obj = self._create_assembly_object(
+                    entry["name"],
+                    loc,
+                    None if entry["color"] is None else tuple(entry["color"]),
+                    cache.ref(entry),
+                    [] if entry["assembly"] else None,
+                    proto_id,
                 )
-                result.append(assembly)
-            return result
+                if obj.shape is not None and (part_ids is None or obj.name in part_ids):
+                    resolve_shape(obj)
+                if proto_id is not None:
+                    self.prototypes[proto_id] = obj
+                nodes.append(obj)
+
+            if parent is None:
+                roots.append(obj)
+            else:
+                parent.shapes.append(obj)
 
-        with open(filename, "rb") as fd:
-            self.assemblies = _load_assembly(pickle.load(fd))
+        self.assemblies = roots
@@ -0,0 +1,265 @@
+# Lightweight scanner for the product structure of STEP files
+#
+# The scanner memory-maps a STEP file and only looks at the entities
+# that describe the product/assembly hierarchy (PRODUCT,
+# PRODUCT_DEFINITION, NEXT_ASSEMBLY_USAGE_OCCURRENCE and the shape
+# representations of the parts). No geometry is built, so listing the
+# parts of a large file does not have to pay for the XCAF transfer.
+#
+# Names follow what StepReader.get_name reports for the same file. This
+# is best effort: the compounds split by StepReader.get_shape_details
+# are predicted from the number of solids in a part's representation.
+
+import mmap
+import re
+
+from .stepreader import clean_string
+
+_PRODUCT = b"PRODUCT"
+_FORMATION = (
+    b"PRODUCT_DEFINITION_FORMATION",
+    b"PRODUCT_DEFINITION_FORMATION_WITH_SPECIFIED_SOURCE",
+)
+_DEFINITION = (
+    b"PRODUCT_DEFINITION",
+    b"PRODUCT_DEFINITION_WITH_ASSOCIATED_DOCUMENTS",
+)
+_NAUO = b"NEXT_ASSEMBLY_USAGE_OCCURRENCE"
+_DEFINITION_SHAPE = b"PRODUCT_DEFINITION_SHAPE"
+_SDR = b"SHAPE_DEFINITION_REPRESENTATION"
+_SRR = b"SHAPE_REPRESENTATION_RELATIONSHIP"
+_SOLIDS = (b"MANIFOLD_SOLID_BREP", b"BREP_WITH_VOIDS", b"FACETED_BREP")
+_SHELLS = (b"SHELL_BASED_SURFACE_MODEL", b"GEOMETRIC_CURVE_SET")
+
+# simple entity instances of the types above, complex instances
+# ("#1 = ( A() B() );") are assembly placements and are not needed
+_ENTITY_RE = re.compile(
+    rb"#(\d+)\s*=\s*("
+    rb"PRODUCT(?:_DEFINITION(?:_FORMATION(?:_WITH_SPECIFIED_SOURCE)?"
+    rb"|_WITH_ASSOCIATED_DOCUMENTS|_SHAPE)?)?"
+    rb"|NEXT_ASSEMBLY_USAGE_OCCURRENCE"
+    rb"|SHAPE_DEFINITION_REPRESENTATION"
+    rb"|SHAPE_REPRESENTATION_RELATIONSHIP"
+    rb"|(?:ADVANCED_BREP_|FACETED_BREP_|MANIFOLD_SURFACE_|"
+    rb"GEOMETRICALLY_BOUNDED_SURFACE_|GEOMETRICALLY_BOUNDED_WIREFRAME_)?"
+    rb"SHAPE_REPRESENTATION"
+    rb"|MANIFOLD_SOLID_BREP|BREP_WITH_VOIDS|FACETED_BREP"
+    rb"|SHELL_BASED_SURFACE_MODEL|GEOMETRIC_CURVE_SET"
+    rb")\s*\("
+)
+
+_TOKEN_RE = re.compile(
+    rb"\s*(?:(?P<str>'(?:[^']|'')*')|(?P<ref>#\d+)|(?P<open>\()|(?P<close>\))"
+    rb"|(?P<sep>,)|(?P<other>[^,()'\s]+))"
+)
+
+
+def decode_string(s):
+    """
+    Decode a STEP string literal body (without the quotes), handling the
+    \\X2\\ (UTF-16), \\X\\ (ISO 8859-1) and \\S\\ control directives
+    :param s: bytes
+    :return: str
+    """
+    s = s.replace(b"''", b"'")
+    if b"\\" not in s:
+        return s.decode("latin-1")
+
+    result = []
+    i = 0
+    while i < len(s):
+        if s.startswith(b"\\X2\\", i) or s.startswith(b"\\X4\\", i):
+            width = 4 if s[i + 2] == ord("2") else 8
+            end = s.index(b"\\X0\\", i + 4)
+            hexdigits = s[i + 4 : end]
+            for j in range(0, len(hexdigits), width):
+                result.append(chr(int(hexdigits[j : j + width], 16)))
+            i = end + 4
+        elif s.startswith(b"\\X\\", i):
+            result.append(chr(int(s[i + 3 : i + 5], 16)))
+            i += 5
+        elif s.startswith(b"\\S\\", i):
+            result.append(chr(s[i + 3] + 128))
+            i += 4
+        elif s.startswith(b"\\\\", i):
+            result.append("\\")
+            i += 2
+        else:
+            result.append(chr(s[i]))
+            i += 1
+    return "".join(result)
+
+
+def parse_arguments(buffer, pos):
+    """
+    Parse the argument list of an entity instance
+    :param buffer: STEP file content
+    :param pos: position right after the opening parenthesis
+    :return: list of arguments, strings are str, references int, lists are
+             nested lists and everything else is kept as bytes
+    """
+    stack = [[]]
+    while True:
+        m = _TOKEN_RE.match(buffer, pos)
+        if m is None:
+            raise ValueError(f"Cannot parse STEP entity at offset {pos}")
+        pos = m.end()
+        kind = m.lastgroup
+        if kind == "str":
+            stack[-1].append(decode_string(m.group("str")[1:-1]))
+        elif kind == "ref":
+            stack[-1].append(int(m.group("ref")[1:]))
+        elif kind == "open":
+            stack.append([])
+        elif kind == "close":
+            args = stack.pop()
+            if not stack:
+                return args
+            stack[-1].append(args)
+        elif kind == "other":
+            stack[-1].append(m.group("other"))
+
+
+class StepScanner:
+    """Builds the product hierarchy of a STEP file without a transfer"""
+
+    def __init__(self, split_compounds=True):
+        self.split_compounds = split_compounds
+        self.products = {}  # PRODUCT -> name
+        self.formations = {}  # PRODUCT_DEFINITION_FORMATION -> PRODUCT
+        self.definitions = {}  # PRODUCT_DEFINITION -> PRODUCT_DEFINITION_FORMATION
+        self.occurrences = []  # (relating, related) PRODUCT_DEFINITION pairs
+        self.definition_shapes = {}  # PRODUCT_DEFINITION_SHAPE -> definition
+        self.representations = {}  # shape representation -> items
+        self.shape_definitions = []  # (PRODUCT_DEFINITION_SHAPE, representation)
+        self.relationships = []  # (representation, representation)
+        self.solids = set()
+        self.shells = set()
+
+    def scan(self, filename):
+        """
+        Scan a STEP file
+        :param filename: name of the STEP file
+        :return: list of nodes with the keys "name", "entity" (the
+                 PRODUCT_DEFINITION) and "shapes" (children, None for parts)
+        """
+        with open(filename, "rb") as fd:
+            with mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                for m in _ENTITY_RE.finditer(buffer):
+                    self._add_entity(int(m.group(1)), m.group(2), buffer, m.end())
+        return self._build()
+
+    def _add_entity(self, entity, typ, buffer, pos):
+        if typ in _SOLIDS:
+            self.solids.add(entity)
+            return
+        if typ in _SHELLS:
+            self.shells.add(entity)
+            return
+
+        args = parse_arguments(buffer, pos)
+        if typ == _PRODUCT:
+            # XCAF names a product by its name, or its id if it has none
+            self.products[entity] = args[1] or args[0]
+        elif typ in _FORMATION:
+            self.formations[entity] = args[2]
+        elif typ in _DEFINITION:
+            self.definitions[entity] = args[2]
+        elif typ == _NAUO:
+            self.occurrences.append((args[3], args[4]))
+        elif typ == _DEFINITION_SHAPE:
+            self.definition_shapes[entity] = args[2]
+        elif typ == _SDR:
+            self.shape_definitions.append((args[0], args[1]))
+        elif typ == _SRR:
+            self.relationships.append((args[2], args[3]))
+        elif isinstance(args[1], list):
+            self.representations[entity] = args[1]
+
+    def _name(self, definition):
+        product = self.products.get(self.formations.get(self.definitions[definition]))
+        return clean_string(product) if product else "Component"
+
+    def _build(self):
+        children = {}
+        components = set()
+        for relating, related in self.occurrences:
+            if relating in self.definitions and related in self.definitions:
+                children.setdefault(relating, []).append(related)
+                components.add(related)
+
+        # representations of each product definition, following the
+        # relationships between representations
+        related_reps = {}
+        for rep1, rep2 in self.relationships:
+            related_reps.setdefault(rep1, []).append(rep2)
+            related_reps.setdefault(rep2, []).append(rep1)
+        reps = {}
+        for pds, rep in self.shape_definitions:
+            definition = self.definition_shapes.get(pds)
+            if definition in self.definitions:
+                reps.setdefault(definition, []).append(rep)
+
+        def count_items(definition):
+            n_solids = n_items = 0
+            seen = set()
+            todo = list(reps.get(definition, []))
+            while todo:
+                rep = todo.pop()
+                if rep in seen:
+                    continue
+                seen.add(rep)
+                for item in self.representations.get(rep, []):
+                    if item in self.solids:
+                        n_solids += 1
+                        n_items += 1
+                    elif item in self.shells:
+                        n_items += 1
+                todo.extend(related_reps.get(rep, []))
+            return n_solids, n_items
+
+        def node(definition):
+            name = self._name(definition)
+            if definition in children:
+                return {
+                    "name": name,
+                    "entity": definition,
+                    "shapes": [node(c) for c in children[definition]],
+                }
+
+            n_solids, n_items = count_items(definition)
+            if self.split_compounds and n_items > 1 and n_solids > 0:
+                # a compound of solids, see StepReader.get_shape_details
+                shapes = [
+                    {"name": f"{name}_{i+1}", "entity": definition, "shapes": None}
+                    for i in range(n_solids)
+                ]
+            else:
+                shapes = None
+            return {"name": name, "entity": definition, "shapes": shapes}
+
+        return [node(d) for d in self.definitions if d not in components]
+
+
+def part_names(nodes):
+    """
+    Return the names of all parts (leaves) of scanned nodes, in the same
+    order as CADSource.parts()
+    """
+    result = []
+    for n in nodes:
+        if n["shapes"] is None:
+            result.append(n["name"])
+        else:
+            result.extend(part_names(n["shapes"]))
+    return result
+
+
+def part_ids(filename, split_compounds=True):
+    """
+    Return the part ids of a STEP file without transferring any geometry
+    :param filename: name of the STEP file
+    :param split_compounds: as in StepReader
+    :return: list of str
+    """
+    return part_names(StepScanner(split_compounds).scan(filename))
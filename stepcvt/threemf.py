@@ -0,0 +1,172 @@
+# 3MF packages of the parts of a project
+#
+# Unlike STL, 3MF separates geometry from placement: every unique mesh is
+# written once as an object resource and each copy of a part is a build
+# item referencing it with a transform. Jobs (see export.ExportJob) share
+# an object if their shapes have the same geometry (also across sources)
+# and tolerances; rotation, scale and copies only change the transforms
+# of the build items.
+#
+# The package is a zip file written as a stream: the meshes are
+# formatted and compressed in chunks while meshing, only one mesh is in
+# memory at a time.
+
+import hashlib
+import os
+import time
+import zipfile
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+from . import instrumentation
+from .export import DEFAULT_SPACING, MeshedShape, transform_matrix
+from .ocp_utils import geometry_buffer
+from .progress import Progress
+
+CONTENT_TYPES = """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+ <Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+ <Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+</Types>
+"""
+
+RELATIONSHIPS = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+ <Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>
+"""
+
+MODEL_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<model unit="millimeter" xml:lang="en-US" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">
+ <resources>
+"""
+
+# vertices and triangles formatted at once
+CHUNK = 65536
+
+# the options of a job that change its mesh
+_MESH_OPTIONS = ("tolerance", "angularTolerance", "relativeTolerance", "triangleBudget")
+
+
+def _write_rows(fd, fmt, rows):
+    for start in range(0, len(rows), CHUNK):
+        chunk = rows[start : start + CHUNK].tolist()
+        fd.write("".join(map(fmt.__mod__, map(tuple, chunk))).encode())
+
+
+def write_object(fd, object_id, name, mesh):
+    """
+    Write a mesh as object resource
+    :param fd: binary file
+    :param object_id: id of the object, referenced by build items
+    :param name: name of the object
+    :param mesh: mesh.Mesh, welded
+    """
+    fd.write(
+        f'  <object id="{object_id}" name={quoteattr(name)} type="model">\n'
+        "   <mesh>\n    <vertices>\n".encode()
+    )
+    _write_rows(fd, '     <vertex x="%.7g" y="%.7g" z="%.7g"/>\n', mesh.vertices)
+    fd.write(b"    </vertices>\n    <triangles>\n")
+    _write_rows(fd, '     <triangle v1="%d" v2="%d" v3="%d"/>\n', mesh.triangles)
+    fd.write(b"    </triangles>\n   </mesh>\n  </object>\n")
+
+
+def item_transform(matrix, offset):
+    """
+    Format the transform attribute of a build item
+    :param matrix: 3x3 NumPy array, applied to column vectors
+    :param offset: translation
+    :return: str, the 3MF matrix for row vectors
+    """
+    values = np.vstack([matrix.T, offset]).reshape(-1)
+    return " ".join("%.9g" % v for v in values)
+
+
+def fingerprint(shape):
+    """Hash of the geometry of a shape, equal for identical prototypes"""
+    return hashlib.sha256(geometry_buffer(shape.wrapped)).hexdigest()
+
+
+def write_3mf(jobs, filename, progress=None):
+    """
+    Write the parts of all jobs into one 3MF package
+    :param jobs: list of export.ExportJobs, their filenames are ignored
+    :param filename: name of the 3MF file
+    :param progress: progress.Progress, reports the phase "mesh"
+    :return: dict with the number of "objects", build "items" and
+             "triangles" of the objects
+    """
+    if progress is None:
+        progress = Progress()
+    progress.start([("mesh", 1)])
+
+    groups = {}  # mesh key -> indices of the jobs
+    with instrumentation.span("fingerprint"):
+        fingerprints = {}
+        for i, job in enumerate(jobs):
+            if id(job.shape) not in fingerprints:
+                fingerprints[id(job.shape)] = fingerprint(job.shape)
+            key = (fingerprints[id(job.shape)],) + tuple(
+                job.options.get(name) for name in _MESH_OPTIONS
+            )
+            groups.setdefault(key, []).append(i)
+
+    items = []  # (object id, transform)
+    triangles = 0
+    # the file is replaced, never overwritten
+    tmp_file = f"{filename}.{os.getpid()}.tmp"
+    date_time = time.localtime()[:6]
+    try:
+        with zipfile.ZipFile(tmp_file, "w", zipfile.ZIP_DEFLATED) as package:
+
+            def entry(name):
+                info = zipfile.ZipInfo(name, date_time)
+                info.compress_type = zipfile.ZIP_DEFLATED
+                return info
+
+            package.writestr(entry("[Content_Types].xml"), CONTENT_TYPES)
+            package.writestr(entry("_rels/.rels"), RELATIONSHIPS)
+            with package.open(entry("3D/3dmodel.model"), "w", force_zip64=True) as fd:
+                fd.write(MODEL_HEADER.encode())
+                for object_id, group in enumerate(groups.values(), 1):
+                    progress.update("mesh", (object_id - 1) / len(groups))
+                    first = jobs[group[0]]
+                    meshed = MeshedShape(first.shape, first.options, first.part_id)
+                    meshed.mesh()
+                    with instrumentation.span("write", part=first.part_id):
+                        mesh = meshed.extract().welded()
+                        write_object(fd, object_id, first.part_id, mesh)
+                    triangles += len(mesh)
+
+                    for i in group:
+                        options = jobs[i].options
+                        matrix = transform_matrix(options)
+                        if matrix is None:
+                            matrix = np.eye(3)
+                        # copies side by side along x, as in the STL files
+                        x = mesh.vertices @ matrix[0]
+                        step = (np.ptp(x) if len(x) else 0.0) + options.get(
+                            "spacing", DEFAULT_SPACING
+                        )
+                        for n in range(options.get("copies", 1)):
+                            items.append(
+                                (object_id, item_transform(matrix, (n * step, 0, 0)))
+                            )
+
+                fd.write(b" </resources>\n <build>\n")
+                for object_id, transform in items:
+                    fd.write(
+                        f'  <item objectid="{object_id}" transform="{transform}"/>\n'.encode()
+                    )
+                fd.write(b" </build>\n</model>\n")
+        os.replace(tmp_file, filename)
+    finally:
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+    progress.update("mesh", 1.0)
+
+    instrumentation.count("3mf.objects", len(groups))
+    instrumentation.count("3mf.items", len(items))
+    return {"objects": len(groups), "items": len(items), "triangles": triangles}
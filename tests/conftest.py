@@ -0,0 +1,12 @@
+import pytest
+
+from stepcvt import stepreader
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Keep the parse cache of Project and CADSource loads out of ~/.cache"""
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setenv("STEPCVT_CACHE_DIR", str(cache_dir))
+    monkeypatch.setattr(stepreader, "DEFAULT_CACHE_DIR", str(cache_dir))
+    return cache_dir
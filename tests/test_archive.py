@@ -0,0 +1,76 @@
+import hashlib
+import io
+import json
+import tarfile
+import zipfile
+
+import pytest
+
+from stepcvt.archive import Archive, MANIFEST
+
+
+def make_files(path):
+    files = {}
+    for name, data in [("a.stl", b"a" * 1000), ("b.stl", b"b" * 10)]:
+        files[name] = path / name
+        files[name].write_bytes(data)
+    return files
+
+
+def add_files(archive, files):
+    archive.add("a.stl", files["a.stl"], part_id="a")
+    archive.add("a_2.stl", files["a.stl"], same_as="a.stl", part_id="a")
+    archive.add("b.stl", files["b.stl"], part_id="b")
+    archive.add("b.stl", files["b.stl"], part_id="b")
+    archive.close(parts={"a": 2, "b": 1})
+
+
+def check_manifest(data):
+    manifest = json.loads(data)
+    assert manifest["parts"] == {"a": 2, "b": 1}
+    assert [f["name"] for f in manifest["files"]] == ["a.stl", "a_2.stl", "b.stl"]
+    a, a_2, b = manifest["files"]
+    assert a["sha256"] == a_2["sha256"] == hashlib.sha256(b"a" * 1000).hexdigest()
+    assert a["bytes"] == 1000
+    assert a_2["part_id"] == "a"
+    return manifest
+
+
+def test_Archive_zip(tmp_path):
+    files = make_files(tmp_path)
+    add_files(Archive(tmp_path / "out.zip", "zip"), files)
+
+    with zipfile.ZipFile(tmp_path / "out.zip") as package:
+        assert package.namelist() == ["a.stl", "a_2.stl", "b.stl", MANIFEST]
+        assert package.read("a_2.stl") == b"a" * 1000
+        check_manifest(package.read(MANIFEST))
+
+
+@pytest.mark.parametrize("format", ["tar", "tar.gz"])
+def test_Archive_tar_stream(tmp_path, format):
+    files = make_files(tmp_path)
+    # a stream that cannot seek, like stdout
+    stream = io.BytesIO()
+    stream.seekable = lambda: False
+    add_files(Archive(stream, format), files)
+
+    with tarfile.open(fileobj=io.BytesIO(stream.getvalue())) as tar:
+        assert tar.getnames() == ["a.stl", "a_2.stl", "b.stl", MANIFEST]
+        assert tar.getmember("a_2.stl").islnk()
+        assert tar.extractfile("a_2.stl").read() == b"a" * 1000
+        check_manifest(tar.extractfile(MANIFEST).read())
+
+
+def test_Archive_format(tmp_path):
+    with pytest.raises(ValueError):
+        Archive(tmp_path / "out.rar", "rar")
+
+
+@pytest.mark.parametrize("format", ["zip", "tar"])
+def test_Archive_abort(tmp_path, format):
+    files = make_files(tmp_path)
+    archive = Archive(tmp_path / "out", format)
+    archive.add("a.stl", files["a.stl"])
+    assert not (tmp_path / "out").exists()
+    archive.abort()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.stl", "b.stl"]
@@ -0,0 +1,89 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from stepcvt.choices import *
+from stepcvt.choices.bitset import Encoding
+
+choices = Choices.from_dict(
+    [
+        {
+            "type": "SingleChooser",
+            "text": "Model",
+            "varname": "Model",
+            "values": [{"text": v, "value": v} for v in ("V4", "V5", "V6")],
+        },
+        {
+            "type": "MultiChooser",
+            "text": "Options",
+            "varname": "Options",
+            "values": [{"text": f"O{i}", "value": f"O{i}"} for i in range(70)],
+        },
+    ]
+)
+
+configurations = [
+    UserChoices({"Model": model, "Options": set(options)})
+    for model in ("V4", "V5", "V6")
+    for options in itertools.combinations(["O0", "O1", "O69"], 2)
+]
+
+
+def test_encode():
+    encoding = Encoding(choices)
+    assert encoding.words == 2
+    config = encoding.encode(UserChoices({"Model": "V5", "Options": ["O69"]}))
+    assert config.tolist() == [2, 1 << (72 - 64)]
+    assert encoding.encode_many(configurations).shape == (len(configurations), 2)
+    with pytest.raises(AttributeError, match="Unidentified options"):
+        encoding.encode(UserChoices({"Model": "V7", "Options": set()}))
+    # an unmade choice cannot be evaluated, not even by 'Model != ...'
+    with pytest.raises(AttributeError, match=r"No choice made for \['Model'\]"):
+        encoding.encode(UserChoices({"Options": ["O1"]}))
+    with pytest.raises(NameError):
+        ChoiceExpr("Model != 'V4'").eval(UserChoices({"Options": ["O1"]}))
+
+
+@pytest.mark.parametrize(
+    "expr",
+    [
+        "Model == 'V4'",
+        "'V6' != Model",
+        "Model in ('V4', 'V5')",
+        "Model not in ['V5']",
+        "'O69' in Options and Model == 'V6'",
+        "not 'O1' in Options or 'O0' not in Options",
+        "True and Model == 'V9'",
+    ],
+)
+def test_evaluate(expr):
+    encoding = Encoding(choices)
+    results = encoding.evaluate(ChoiceExpr(expr), encoding.encode_many(configurations))
+    assert results.tolist() == [bool(ChoiceExpr(expr).eval(c)) for c in configurations]
+
+
+@pytest.mark.parametrize(
+    "expr", ["'V' in Model", "Options == 'O1'", "Model == Options", "1 + 1"]
+)
+def test_cannot_lower(expr):
+    with pytest.raises(ValueError, match="Cannot lower"):
+        Encoding(choices).lower(expr)
+
+
+def test_evaluate_table():
+    effects = [
+        SelectionEffect("'O0' in Options"),
+        RelativeCountEffect("Model == 'V5'", 2),
+        AbsoluteCountEffect("'O69' in Options and Model == 'V6'", 5),
+        ScaleEffect("Model in ('V4', 'V6')", 1.5),
+    ]
+    table = EffectTable([(effects, (True, 1, 1.0)), ([], (False, 2, 1.0))])
+    encoding = Encoding(choices)
+    selected, count, scale = encoding.evaluate_table(
+        table, encoding.encode_many(configurations)
+    )
+    expected = [table.evaluate(c) for c in configurations]
+    assert selected.tolist() == [[bool(s) for s, _, _ in e] for e in expected]
+    assert count.tolist() == [[c for _, c, _ in e] for e in expected]
+    assert np.allclose(scale, [[s for _, _, s in e] for e in expected])
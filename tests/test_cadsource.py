@@ -202,3 +202,18 @@ def test_CADSource_add_partinfo(tmp_path):
         assert isinstance(pi, PartInfo)
         assert pi.part_id == partid
         assert cs.partinfo[-1] is pi
+
+
+def test_CADSource_parts_unique(tmp_path):
+    model_file = tmp_path / "desk.step"
+    desk = models.desk_model()
+    desk.add(desk.children[1], name="spare_leg")
+    desk.save(str(model_file))
+
+    cs = CADSource.load_step_file("desk", model_file)
+
+    partids = [partid for partid, _ in cs.parts()]
+    unique_partids = [partid for partid, _ in cs.parts(unique=True)]
+    assert len(unique_partids) == len(set(unique_partids))
+    assert set(unique_partids) == set(partids)
+    assert len(unique_partids) < len(partids)
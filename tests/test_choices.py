@@ -46,6 +46,31 @@ def test_choice_expr():
     assert choice_expr_v4.eval(user_choices)
 
 
+def test_choice_expr_compiled_once():
+    ChoiceExpr.compile.cache_clear()
+    expr = ChoiceExpr(
+        "NevermoreModel in ('V4', 'V5') and not 'Lights' in PrinterOptions"
+    )
+    assert expr.vars() == ["NevermoreModel", "PrinterOptions"]
+    assert not expr.eval(user_choices)
+    assert not ChoiceExpr(expr.expr).eval(user_choices)
+    assert ChoiceExpr.compile.cache_info().misses == 1
+
+
+@pytest.mark.parametrize(
+    "expr",
+    [
+        "NevermoreModel == 'V4' and __import__('os')",
+        "NevermoreModel == 'V4' or NevermoreModel.upper()",
+        "'Lights' in [PrinterOptions.pop()]",
+        "(lambda: True)()",
+    ],
+)
+def test_choice_expr_unsafe(expr):
+    with pytest.raises(AttributeError, match="Unsupported expression type"):
+        ChoiceExpr(expr).eval(user_choices)
+
+
 def test_selection_effect():
     partinfo.choice_effects.append(
         SelectionEffect(ChoiceExpr("'Lights' in PrinterOptions"))
@@ -105,6 +130,137 @@ def test_scale_effect():
     assert math.isclose(partinfo.scale, 1.2)
 
 
+def test_effect_table():
+    effects = [
+        SelectionEffect("'Lights' in PrinterOptions"),
+        RelativeCountEffect("'Filter' in PrinterOptions", 2),
+        ScaleEffect("NevermoreModel == 'V6'", 1.5),
+    ]
+    table = EffectTable(
+        [(effects, (False, 1, 1.0)), ([], (True, 3, 2.0)), (effects, (False, 1, 1.0))]
+    )
+    assert len(table.rows) == 2
+    # stateless: applying the same choices again gives the same counts
+    for _ in range(2):
+        assert table.evaluate(user_choices) == [
+            (True, 3, 1.0),
+            (True, 3, 2.0),
+            (True, 3, 1.0),
+        ]
+    v6 = UserChoices({"NevermoreModel": "V6", "PrinterOptions": set()})
+    assert table.evaluate(v6)[0] == (False, 1, 1.5)
+
+
+def test_accept_user_choices_from_defaults():
+    p = Project("Counts", available_choices=Choices.from_dict(choices_dict))
+    info = PartInfo(
+        "Filter",
+        count=1,
+        choice_effect=[RelativeCountEffect("'Filter' in PrinterOptions", 1)],
+    )
+    p.sources.append(CADSource("Filter", None, [info]))
+    p.accept_user_choices(user_choices)
+    p.accept_user_choices(user_choices)
+    assert info.count == 2
+    # changed effects and defaults are seen without invalidating
+    info.choice_effects.append(ScaleEffect("NevermoreModel == 'V4'", 0.5))
+    p.accept_user_choices(user_choices)
+    assert (info.count, info.scale) == (2, 0.5)
+    info._default_count = 3
+    p.accept_user_choices(user_choices)
+    assert info.count == 4
+
+
+def test_update_from_choices_cached():
+    info = PartInfo(
+        "Filter",
+        count=1,
+        choice_effect=[RelativeCountEffect("'Filter' in PrinterOptions", 1)],
+    )
+    info.update_from_choices(user_choices)
+    table = info._effect_table[1]
+    info.update_from_choices(user_choices)
+    assert info._effect_table[1] is table
+    # changed defaults and effects are seen without invalidating
+    info._default_count = 3
+    info.update_from_choices(user_choices)
+    assert info.count == 4
+    info.choice_effects.append(ScaleEffect("NevermoreModel == 'V4'", 0.5))
+    info.update_from_choices(user_choices)
+    assert (info.count, info.scale) == (4, 0.5)
+
+
+def test_configurations():
+    available = Choices.from_dict(choices_dict)
+    configurations = list(available.configurations())
+    # LightsCtrl only with Lights: 6 option sets for each model
+    assert len(configurations) == available.count() == 12
+    for c in configurations:
+        available.validate(c)
+    assert {"LightsCtrl"} not in [c.choices["PrinterOptions"] for c in configurations]
+
+
+def test_configurations_large():
+    d = [
+        {
+            "type": "MultiChooser",
+            "text": f"Options {i}",
+            "varname": f"Options{i}",
+            "values": [
+                {"text": "A", "value": "A"},
+                {"text": "B", "value": "B", "cond": "Model == 'V6'"},
+                {"text": "C", "value": "C", "cond": f"'A' in Options{i}"},
+            ],
+        }
+        for i in range(40)
+    ]
+    model = {
+        "type": "SingleChooser",
+        "text": "Model",
+        "varname": "Model",
+        "values": [{"text": "V4", "value": "V4"}, {"text": "V6", "value": "V6"}],
+    }
+    available = Choices.from_dict([model] + d)
+    # V4: {}, A, AC; V6: also B, AB, ABC
+    assert available.count() == 3**40 + 6**40
+    first = next(available.configurations())
+    assert first.choices == dict(
+        {"Model": "V4"}, **{f"Options{i}": set() for i in range(40)}
+    )
+
+
+def _single(varname, cond=None):
+    value = {"text": "Yes", "value": "Yes"}
+    if cond:
+        value["cond"] = cond
+    return {
+        "type": "SingleChooser",
+        "text": varname,
+        "varname": varname,
+        "values": [value],
+    }
+
+
+def test_toposort():
+    available = Choices.from_dict(
+        [
+            _single("Lid", "Size == 'Yes' and Model == 'Yes'"),
+            _single("Size", "Model == 'Yes'"),
+            _single("Model", "Model == 'Yes'"),
+            _single("Color"),
+        ]
+    )
+    order = [c.varname for c in available.toposort()]
+    assert order == ["Model", "Color", "Size", "Lid"]
+    # preconditions see their dependencies in any order of the user choices
+    available.validate(UserChoices({"Lid": "Yes", "Size": "Yes", "Model": "Yes"}))
+
+    # choosers edited in place are sorted again
+    available.choices[2].values[0].cond = ChoiceExpr("Lid == 'Yes'")
+    with pytest.raises(ValueError, match="Circular dependency"):
+        available.toposort()
+
+
 def test_invalid_user_choice():
     # potentially better error messages?
     with pytest.raises(
@@ -0,0 +1,277 @@
+import threading
+import time
+
+import cadquery as cq
+import numpy as np
+import pytest
+
+from stepcvt import export, instrumentation, mesh
+from stepcvt.export import ExportJob
+from stepcvt.progress import CancelToken, Cancelled, Progress
+
+
+def make_jobs(path):
+    cone = cq.Solid.makeCone(2, 1, 5)
+    sphere = cq.Solid.makeSphere(2)
+    options = {"rotation": [30, 45, 10], "tolerance": 0.01, "angularTolerance": 0.2}
+    return [
+        ExportJob("cone", cone, path / "cone.stl", options),
+        ExportJob("sphere", sphere, path / "sphere.stl"),
+        ExportJob("cone", cone, path / "cone_2.stl", options),
+    ]
+
+
+def test_export_serial(tmp_path):
+    jobs = make_jobs(tmp_path)
+    results = export.export(jobs)
+
+    assert all(r["ok"] for r in results)
+    assert results[0]["triangles"] > 0
+    assert set(results[0]["seconds"]) == {"transform", "mesh", "write"}
+    # same shape and options, the file is copied
+    assert results[2]["copied_from"] == str(tmp_path / "cone.stl")
+    assert (tmp_path / "cone_2.stl").read_bytes() == (
+        tmp_path / "cone.stl"
+    ).read_bytes()
+
+
+def test_export_workers(tmp_path):
+    serial = tmp_path / "serial"
+    parallel = tmp_path / "parallel"
+    serial.mkdir()
+    parallel.mkdir()
+
+    export.export(make_jobs(serial))
+    results = export.export(make_jobs(parallel), workers=2)
+
+    assert all(r["ok"] for r in results)
+    for name in ["cone.stl", "sphere.stl", "cone_2.stl"]:
+        assert (parallel / name).read_bytes() == (serial / name).read_bytes()
+
+
+def test_export_error(tmp_path):
+    job = ExportJob("cone", cq.Solid.makeCone(2, 1, 5), tmp_path / "no" / "cone.stl")
+    (result,) = export.export([job])
+    assert not result["ok"]
+    assert result["error"]
+
+
+def test_export_mesh_cache(tmp_path):
+    cache_dir = tmp_path / "meshes"
+    first = tmp_path / "first"
+    second = tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+
+    results = export.export(make_jobs(first), cache_dir=str(cache_dir))
+    assert not any(r.get("cached") for r in results)
+    assert len(list(cache_dir.iterdir())) == 2
+
+    results = export.export(make_jobs(second), cache_dir=str(cache_dir))
+    assert all(r.get("cached") for r in results)
+    for name in ["cone.stl", "sphere.stl", "cone_2.stl"]:
+        assert (second / name).read_bytes() == (first / name).read_bytes()
+    assert results[0]["triangles"] > 0
+
+    # other options are another mesh
+    job = ExportJob(
+        "sphere", cq.Solid.makeSphere(2), second / "sphere.stl", {"scale": 2.0}
+    )
+    (result,) = export.export([job], cache_dir=str(cache_dir))
+    assert not result.get("cached")
+    assert len(list(cache_dir.iterdir())) == 3
+
+
+def test_export_hardlink(tmp_path):
+    results = export.export(make_jobs(tmp_path), link="hardlink")
+    assert all(r["ok"] for r in results)
+    assert (tmp_path / "cone_2.stl").samefile(tmp_path / "cone.stl")
+
+    # exporting again replaces the files instead of writing through the link
+    export.export(make_jobs(tmp_path)[:1], link="hardlink")
+    assert not (tmp_path / "cone_2.stl").samefile(tmp_path / "cone.stl")
+
+
+@pytest.mark.parametrize("link", export.LINK_MODES)
+def test_emit_replaces_link(tmp_path, link):
+    cached_x, cached_y, out = (tmp_path / name for name in ("x", "y", "out.stl"))
+    cached_x.write_bytes(b"X")
+    cached_y.write_bytes(b"Y")
+    export.emit(cached_x, out, "hardlink")
+    export.emit(cached_y, out, link)
+    assert out.read_bytes() == b"Y"
+    assert cached_x.read_bytes() == b"X"
+
+
+def test_export_copies(tmp_path):
+    cone = cq.Solid.makeCone(2, 1, 5)
+    single, combined = export.export(
+        [
+            ExportJob("cone", cone, tmp_path / "cone.stl"),
+            ExportJob("cone", cone, tmp_path / "cones.stl", {"copies": 4}),
+        ]
+    )
+    assert combined["triangles"] == 4 * single["triangles"]
+    assert export._stl_triangles(tmp_path / "cones.stl") == combined["triangles"]
+
+
+def test_export_numpy_writer(tmp_path):
+    occt = tmp_path / "occt"
+    numpy = tmp_path / "numpy"
+    occt.mkdir()
+    numpy.mkdir()
+
+    export.export(make_jobs(occt))
+    results = export.export(make_jobs(numpy), writer="numpy")
+
+    assert all(r["ok"] for r in results)
+    for name in ["cone.stl", "sphere.stl"]:
+        assert (numpy / name).read_bytes() == (occt / name).read_bytes()
+
+
+def test_transform_matrix():
+    assert export.transform_matrix({}) is None
+    assert export.transform_matrix({"rotation": [0, 0, 0], "scale": 1.0}) is None
+
+    # same as rotating and scaling the BRep
+    options = {"rotation": [30, 45, 10], "scale": 2.0}
+    cone = cq.Solid.makeCone(2, 1, 5)
+    expected = export.rotate(cone.scale(2.0), options["rotation"])
+    matrix = export.transform_matrix(options)
+    for vertex, moved in zip(cone.Vertices(), expected.Vertices()):
+        assert np.allclose(matrix @ vertex.toTuple(), moved.toTuple())
+
+
+def test_export_shared_mesh(tmp_path):
+    cone = cq.Solid.makeCone(2, 1, 5)
+    recorder = instrumentation.enable()
+    try:
+        results = export.export(
+            [
+                ExportJob("cone", cone, tmp_path / "cone.stl"),
+                ExportJob("cone", cone, tmp_path / "big.stl", {"scale": 2.0}),
+                ExportJob("cone", cone, tmp_path / "up.stl", {"rotation": [90, 0, 0]}),
+                ExportJob("cone", cone, tmp_path / "mirror.stl", {"scale": -1.0}),
+            ]
+        )
+    finally:
+        instrumentation.disable()
+
+    assert all(r["ok"] for r in results)
+    assert recorder.summary()["spans"]["mesh"]["calls"] == 1
+    assert len({r["triangles"] for r in results}) == 1
+
+    def read(name):
+        data = (tmp_path / name).read_bytes()
+        records = np.frombuffer(data[84:], dtype=mesh._STL_RECORD)
+        return records["normal"], records["vertices"]
+
+    normals, vertices = read("cone.stl")
+    big_normals, big_vertices = read("big.stl")
+    assert np.allclose(big_vertices, 2 * vertices, atol=1e-5)
+    assert np.allclose(big_normals, normals, atol=1e-5)
+
+    # mirrored, the winding is flipped and the normals still point outwards
+    mirror_normals, mirror_vertices = read("mirror.stl")
+    assert np.allclose(mirror_vertices, -vertices[:, [0, 2, 1]], atol=1e-5)
+    assert np.allclose(mirror_normals, -normals, atol=1e-5)
+
+
+def test_export_relative_tolerance(tmp_path):
+    # the same relative tolerance gives the same mesh at any size
+    small = cq.Solid.makeTorus(0.2, 0.05)
+    large = cq.Solid.makeTorus(20, 5)
+    options = {"relativeTolerance": 0.002}
+    results = export.export(
+        [
+            ExportJob("small", small, tmp_path / "small.stl", options),
+            ExportJob("large", large, tmp_path / "large.stl", options),
+        ]
+    )
+    assert results[0]["triangles"] == results[1]["triangles"]
+
+    # coarser
+    job = ExportJob("large", large, tmp_path / "large.stl", {"relativeTolerance": 0.02})
+    (result,) = export.export([job])
+    assert result["triangles"] < results[1]["triangles"]
+
+
+def test_export_triangle_budget(tmp_path):
+    sphere = cq.Solid.makeSphere(3)
+    recorder = instrumentation.enable()
+    try:
+        results = export.export(
+            [
+                ExportJob(
+                    "s", sphere, tmp_path / f"{budget}.stl", {"triangleBudget": budget}
+                )
+                for budget in [500, 2000]
+            ]
+        )
+    finally:
+        instrumentation.disable()
+
+    assert 0.5 * 500 < results[0]["triangles"] <= 500
+    assert 0.5 * 2000 < results[1]["triangles"] <= 2000
+    assert export._stl_triangles(tmp_path / "2000.stl") == results[1]["triangles"]
+    assert recorder.summary()["counters"]["mesh.trials"] <= 2 * export.BUDGET_TRIALS
+
+    # bounded by the planar faces
+    box = cq.Solid.makeBox(1, 2, 3)
+    job = ExportJob("box", box, tmp_path / "box.stl", {"triangleBudget": 5})
+    (result,) = export.export([job])
+    assert result["triangles"] == 12
+
+
+def test_export_on_done(tmp_path):
+    done = []
+
+    def on_done(i, result):
+        # the file is complete when reported
+        assert export._stl_triangles(jobs[i].filename) == result["triangles"]
+        done.append(i)
+
+    jobs = make_jobs(tmp_path)
+    export.export(jobs, workers=2, on_done=on_done)
+    assert sorted(done) == [0, 1, 2]
+
+
+def test_mesh_threads(monkeypatch):
+    monkeypatch.setattr(export.os, "cpu_count", lambda: 8)
+    assert export.mesh_threads() == 8
+    assert export.mesh_threads(workers=3) == 2
+    assert export.mesh_threads(4, workers=4) == 2
+    assert export.mesh_threads(3) == 3
+    assert export.mesh_threads(workers=16) == 1
+
+
+def test_export_threads(tmp_path, monkeypatch):
+    # parallel meshing of the faces does not change the meshes
+    monkeypatch.setattr(export.os, "cpu_count", lambda: 4)
+    single = tmp_path / "single"
+    threads = tmp_path / "threads"
+    single.mkdir()
+    threads.mkdir()
+
+    export.export(make_jobs(single), threads=1)
+    results = export.export(make_jobs(threads), threads=4)
+
+    assert all(r["ok"] for r in results)
+    for name in ["cone.stl", "sphere.stl", "cone_2.stl"]:
+        assert (threads / name).read_bytes() == (single / name).read_bytes()
+
+
+def _slow_group(*args):
+    time.sleep(60)
+
+
+def test_export_cancel_workers(tmp_path, monkeypatch):
+    # workers inherit the patched function (fork)
+    monkeypatch.setattr(export, "_run_serialized", _slow_group)
+    token = CancelToken()
+    threading.Timer(0.5, token.cancel).start()
+    start = time.time()
+    with pytest.raises(Cancelled):
+        export.export(make_jobs(tmp_path), workers=2, progress=Progress(token=token))
+    # the running jobs are not waited for
+    assert time.time() - start < 10
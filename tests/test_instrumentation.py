@@ -0,0 +1,60 @@
+import json
+
+from stepcvt import instrumentation
+from stepcvt.stepreader import StepReader
+import models
+
+
+def test_disabled():
+    assert not instrumentation.enabled()
+    with instrumentation.span("nothing"):
+        instrumentation.count("nothing")
+    assert instrumentation.disable() is None
+
+
+def test_Recorder(tmp_path):
+    recorder = instrumentation.enable()
+    try:
+        with instrumentation.span("outer", name="x"):
+            with instrumentation.span("inner"):
+                pass
+            with instrumentation.span("inner"):
+                pass
+        instrumentation.count("items", 3)
+        instrumentation.count("items")
+    finally:
+        assert instrumentation.disable() is recorder
+
+    summary = recorder.summary()
+    assert summary["spans"]["inner"]["calls"] == 2
+    assert summary["spans"]["outer"]["seconds"] >= 0
+    assert summary["counters"] == {"items": 4}
+
+    trace_file = tmp_path / "trace.json"
+    recorder.write(str(trace_file))
+    trace = json.loads(trace_file.read_text())
+    spans = [e for e in trace["traceEvents"] if e["ph"] == "X"]
+    assert [e["name"] for e in spans] == ["inner", "inner", "outer"]
+    assert spans[-1]["args"] == {"name": "x"}
+    assert trace["counters"] == {"items": 4}
+
+
+def test_StepReader_load_instrumented(tmp_path):
+    model_file = tmp_path / "desk.step"
+    models.desk_model().save(str(model_file))
+    cache_dir = tmp_path / "cache"
+
+    recorder = instrumentation.enable()
+    try:
+        StepReader().load(str(model_file), cache_dir=str(cache_dir))
+        StepReader().load(str(model_file), cache_dir=str(cache_dir))
+    finally:
+        instrumentation.disable()
+
+    summary = recorder.summary()
+    assert {"read", "transfer", "colors", "parse", "cache.save", "cache.load"} <= set(
+        summary["spans"]
+    )
+    assert summary["counters"]["cache.miss"] == 1
+    assert summary["counters"]["cache.hit"] == 1
+    assert summary["counters"]["shapes"] > 0
@@ -1,5 +1,9 @@
 import pytest
+import threading
+import time
 
+from stepcvt import project
+from stepcvt.progress import CancelToken, Cancelled, Progress
 from stepcvt.project import Project, CADSource, PartInfo, TextInfo
 import models
 import sys
@@ -42,3 +46,59 @@ def test_load(tmp_path):
         assert s._CADSource__step is not None
         for part in s.partinfo:
             assert part._cad is not None
+
+
+def test_load_workers(tmp_path, capfd):
+    p = Project(name="Furniture")
+    for name, model in (("book", models.book_model), ("desk", models.desk_model)):
+        model_file = tmp_path / f"{name}.step"
+        model().save(str(model_file))
+        p.add_source(name=name, path=model_file)
+        source = p.sources[-1]
+        for partid, obj in source.parts():
+            source.add_partinfo(partid, obj)
+
+    x = p.to_dict(root=tmp_path)
+    p2 = Project.from_dict(x, tmp_path)
+
+    # parse the sources in two worker processes
+    p2.load(tmp_path, workers=2)
+    assert "Loading STEP files" in capfd.readouterr().out
+
+    for s, s2 in zip(p.sources, p2.sources):
+        assert s2._CADSource__step is not None
+        assert [pi.part_id for pi in s2.partinfo] == [pi.part_id for pi in s.partinfo]
+        for part in s2.partinfo:
+            assert part._cad is not None
+            assert part._cad.isValid()
+
+
+def _slow_read_source(path, geometry_only=False):
+    time.sleep(60)
+
+
+def test_load_workers_cancel(tmp_path, monkeypatch):
+    p = Project(name="Furniture")
+    for name, model in (("book", models.book_model), ("desk", models.desk_model)):
+        model_file = tmp_path / f"{name}.step"
+        model().save(str(model_file))
+        p.add_source(name=name, path=model_file)
+
+    # workers inherit the patched function (fork)
+    monkeypatch.setattr(project, "_read_source", _slow_read_source)
+    token = CancelToken()
+    threading.Timer(0.5, token.cancel).start()
+    start = time.time()
+    with pytest.raises(Cancelled):
+        p.load(tmp_path, workers=2, progress=Progress(token=token))
+    # the running parses are not waited for
+    assert time.time() - start < 10
+
+
+def test_read_source_silent(tmp_path, capfd):
+    model_file = tmp_path / "book.step"
+    models.book_model().save(str(model_file))
+    capfd.readouterr()
+    # the worker output may be an archive written to stdout
+    assert project._read_source(str(model_file))
+    assert capfd.readouterr().out == ""
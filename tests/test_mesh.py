@@ -0,0 +1,29 @@
+import cadquery as cq
+import numpy as np
+
+from stepcvt.mesh import extract_mesh
+
+
+def test_extract_mesh_stl(tmp_path):
+    torus = (
+        cq.Solid.makeTorus(10, 3)
+        .rotate((0, 0, 0), (1, 0, 0), 30)
+        .moved(cq.Location(cq.Vector(1, 2, 3)))
+    )
+    shape = cq.Compound.makeCompound(
+        [torus, torus.moved(cq.Location(cq.Vector(30, 0, 0)))]
+    )
+    shape.exportStl(str(tmp_path / "occt.stl"), 0.01, 0.1)
+
+    mesh = extract_mesh(shape.wrapped)
+    mesh.write_stl(str(tmp_path / "numpy.stl"))
+
+    assert (tmp_path / "numpy.stl").read_bytes() == (tmp_path / "occt.stl").read_bytes()
+    assert len(mesh) == len(mesh.triangles)
+    assert np.allclose(np.linalg.norm(mesh.normals(), axis=1), 1)
+
+
+def test_extract_mesh_empty():
+    mesh = extract_mesh(cq.Solid.makeBox(1, 1, 1).wrapped)
+    assert len(mesh) == 0
+    assert mesh.stl_bytes()[80:84] == b"\0\0\0\0"
@@ -0,0 +1,83 @@
+import json
+
+import cadquery as cq
+import pytest
+
+from stepcvt import export, plan
+from stepcvt.export import ExportJob
+
+SHAPES = {
+    "box": lambda: cq.Solid.makeBox(1, 2, 3),
+    "sphere": lambda: cq.Solid.makeSphere(3),
+    "holes": lambda: cq.Workplane()
+    .box(50, 50, 5)
+    .faces(">Z")
+    .workplane()
+    .rarray(10, 10, 4, 4)
+    .hole(2)
+    .val(),
+}
+
+
+@pytest.mark.parametrize("name", SHAPES)
+@pytest.mark.parametrize("options", [{}, {"tolerance": 0.01, "angularTolerance": 0.2}])
+def test_estimate_triangles(name, options):
+    shape = SHAPES[name]()
+    estimate = plan.estimate_triangles(shape, options)
+    meshed = export.MeshedShape(shape, options)
+    meshed.mesh()
+    assert meshed.triangles / 3 <= estimate <= meshed.triangles * 3
+
+
+def test_plan(tmp_path):
+    sphere = cq.Solid.makeSphere(3)
+    box = cq.Solid.makeBox(1, 2, 3)
+    jobs = [
+        ExportJob("sphere", sphere, tmp_path / "sphere.stl"),
+        ExportJob("sphere", sphere, tmp_path / "sphere_2.stl"),
+        ExportJob("sphere", sphere, tmp_path / "big.stl", {"scale": 2.0}),
+        ExportJob("box", box, tmp_path / "box.stl", {"copies": 3}),
+    ]
+    # the same shape object was meshed before
+    cache_dir = tmp_path / "meshes"
+    job = ExportJob("box", box, tmp_path / "b.stl", {"copies": 3})
+    export.export([job], cache_dir=str(cache_dir))
+
+    result = plan.plan(jobs, str(cache_dir))
+    files = result["files"]
+    assert [f["status"] for f in files] == ["mesh", "copy", "shared", "cached"]
+    assert files[0]["triangles"] == files[2]["triangles"]
+    assert files[3]["triangles"] == 3 * 12
+    assert files[3]["bytes"] == 84 + 50 * 36
+    assert files[0]["seconds"] > 0
+    assert files[1]["seconds"] == files[2]["seconds"] == 0
+
+    totals = result["totals"]
+    assert totals["files"] == 4
+    assert totals["parts"] == 2
+    assert totals["meshes"] == 1
+    assert totals["cached"] == 1
+    assert totals["workers"] == 1
+    # nothing was meshed or written
+    assert not (tmp_path / "sphere.stl").exists()
+    assert not (tmp_path / "box.stl").exists()
+    json.dumps(result)
+    assert "sphere" in plan.format_plan(result)
+
+
+def test_plan_after_cached(tmp_path):
+    cylinder = cq.Solid.makeCylinder(2, 5)
+    cache_dir = tmp_path / "meshes"
+    jobs = [
+        ExportJob("cylinder", cylinder, tmp_path / "a.stl"),
+        ExportJob("cylinder", cylinder, tmp_path / "b.stl", {"rotation": [90, 0, 0]}),
+    ]
+    export.export(jobs[:1], cache_dir=str(cache_dir))
+
+    # the cached file is not meshed, so the rotated copy cannot share it
+    result = plan.plan(jobs, str(cache_dir))
+    assert [f["status"] for f in result["files"]] == ["cached", "mesh"]
+    assert result["files"][1]["seconds"] > 0
+    assert result["totals"]["meshes"] == 1
+    results = export.export(jobs, cache_dir=str(cache_dir))
+    assert [bool(r.get("cached")) for r in results] == [True, False]
@@ -0,0 +1,76 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from stepcvt.progress import Progress, CancelToken, Cancelled, stop_pool
+from stepcvt.stepreader import StepReader
+import models
+
+
+def test_Progress_phases():
+    events = []
+    progress = Progress(lambda *event: events.append(event))
+    progress.start([("read", 3), ("parse", 1)])
+    progress.update("read")
+    progress.update("read", 1.0)
+    progress.update("parse", 0.5)
+    progress.update("parse", 1.0)
+
+    assert events == [
+        ("read", 0.0, 0.0),
+        ("read", 1.0, 0.75),
+        ("parse", 0.5, 0.875),
+        ("parse", 1.0, 1.0),
+    ]
+
+
+def test_Progress_cancel():
+    token = CancelToken()
+    progress = Progress(token=token)
+    progress.start([("read", 1)])
+    progress.update("read")
+
+    token.cancel()
+    assert token.cancelled
+    with pytest.raises(Cancelled):
+        progress.update("read", 0.5)
+
+
+def test_StepReader_load_progress(tmp_path):
+    model_file = tmp_path / "desk.step"
+    models.desk_model().save(str(model_file))
+
+    events = []
+    StepReader().load(
+        str(model_file), progress=Progress(lambda *event: events.append(event))
+    )
+    phases = [phase for phase, _, _ in events]
+    assert phases[0] == "read"
+    assert {"transfer", "parse"} <= set(phases)
+    totals = [total for _, _, total in events]
+    assert totals == sorted(totals)
+    assert totals[-1] == 1.0
+
+    # cancel as soon as the transfer starts
+    token = CancelToken()
+
+    def cancel(phase, fraction, total):
+        if phase == "transfer":
+            token.cancel()
+
+    with pytest.raises(Cancelled):
+        StepReader().load(str(model_file), progress=Progress(cancel, token))
+
+
+def test_stop_pool():
+    start = time.time()
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        futures = [pool.submit(time.sleep, 60) for _ in range(4)]
+        time.sleep(0.5)
+        stop_pool(pool)
+    # neither the running nor the queued jobs are waited for
+    assert time.time() - start < 10
+    for future in futures:
+        assert future.cancelled() or isinstance(future.exception(), BrokenProcessPool)
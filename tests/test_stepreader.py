@@ -0,0 +1,299 @@
+import os
+
+import cadquery as cq
+import pytest
+from OCP.STEPCAFControl import STEPCAFControl_Writer
+from OCP.STEPControl import STEPControl_AsIs
+from OCP.TCollection import TCollection_ExtendedString
+from OCP.TDataStd import TDataStd_Name
+from OCP.TDocStd import TDocStd_Document
+from OCP.TopAbs import TopAbs_SOLID
+from OCP.XCAFDoc import XCAFDoc_DocumentTool
+
+from stepcvt import stepscan
+from stepcvt.assemblycache import AssemblyCache, ShapeRef
+from stepcvt.stepreader import (
+    AssemblyObject,
+    StepReader,
+    DEFAULT_COLOR,
+    resolve_shape,
+)
+import models
+
+
+def test_AssemblyObject():
+    obj = AssemblyObject("part", color=DEFAULT_COLOR)
+    assert obj.name == "part"
+    assert obj["color"] == DEFAULT_COLOR
+    assert obj.get("shapes") is None
+    assert obj.get("other", 1) == 1
+
+    obj["shape"] = 1
+    assert obj.shape == 1
+    assert not hasattr(obj, "__dict__")
+    with pytest.raises(KeyError):
+        obj["other"] = 1
+    with pytest.raises(KeyError):
+        obj["other"]
+
+
+def test_StepReader_cache_key(tmp_path):
+    model_file = tmp_path / "book.step"
+    models.book_model().save(str(model_file))
+
+    key = StepReader().cache_key(str(model_file))
+
+    # same content and flags give the same key
+    assert StepReader().cache_key(str(model_file)) == key
+
+    # reader flags are part of the key
+    assert StepReader(use_colors=False).cache_key(str(model_file)) != key
+
+    # so is the content of the file
+    models.desk_model().save(str(model_file))
+    assert StepReader().cache_key(str(model_file)) != key
+
+
+def test_StepReader_load_cache_dir(tmp_path):
+    model_file = tmp_path / "book.step"
+    models.book_model().save(str(model_file))
+    cache_dir = tmp_path / "cache"
+
+    sr = StepReader()
+    sr.load(str(model_file), cache_dir=str(cache_dir))
+    cache_file = cache_dir / f"{sr.cache_key(str(model_file))}.jq"
+    assert cache_file.exists()
+
+    # a warm load is served from the cache
+    sr2 = StepReader()
+    sr2.load(str(model_file), cache_dir=str(cache_dir))
+    assert sr2.shape_tool is None
+    assert [a["name"] for a in sr2.assemblies[0]["shapes"]] == [
+        a["name"] for a in sr.assemblies[0]["shapes"]
+    ]
+
+    # changing the file invalidates the cache
+    models.desk_model().save(str(model_file))
+    sr3 = StepReader()
+    sr3.load(str(model_file), cache_dir=str(cache_dir))
+    assert sr3.shape_tool is not None
+    assert len(os.listdir(cache_dir)) == 2
+
+
+@pytest.mark.parametrize("size", [0, 4, 12, 40])
+def test_StepReader_load_corrupt_cache(tmp_path, size):
+    model_file = tmp_path / "book.step"
+    models.book_model().save(str(model_file))
+    cache_dir = tmp_path / "cache"
+    sr = StepReader()
+    sr.load(str(model_file), cache_dir=str(cache_dir))
+    cache_file = cache_dir / f"{sr.cache_key(str(model_file))}.jq"
+
+    # a truncated cache is a cache miss, the file is parsed and cached again
+    cache_file.write_bytes(cache_file.read_bytes()[:size])
+    with pytest.warns(RuntimeWarning, match="Ignoring cache"):
+        sr2 = StepReader()
+        sr2.load(str(model_file), cache_dir=str(cache_dir))
+    assert sr2.shape_tool is not None
+    with AssemblyCache.open(str(cache_file)) as cache:
+        assert len(cache.entries) > 1
+    assert cache.buffer.closed
+
+
+def test_StepReader_save_load_assembly(tmp_path):
+    model_file = tmp_path / "desk.step"
+    models.desk_model().save(str(model_file))
+    cache_file = tmp_path / "desk.jq"
+
+    sr = StepReader()
+    sr.load(str(model_file))
+    sr.save_assembly(str(cache_file))
+
+    sr2 = StepReader()
+    sr2.load_assembly(str(cache_file))
+    parts = sr.assemblies[0]["shapes"]
+    parts2 = sr2.assemblies[0]["shapes"]
+    assert [p["name"] for p in parts2] == [p["name"] for p in parts]
+    assert [p["color"] for p in parts2] == [p["color"] for p in parts]
+    for p, p2 in zip(parts, parts2):
+        assert (
+            p2["loc"]
+            .Transformation()
+            .TranslationPart()
+            .IsEqual(p["loc"].Transformation().TranslationPart(), 1e-9)
+        )
+        assert p2["shape"].ShapeType() == p["shape"].ShapeType()
+
+
+def test_StepReader_load_assembly_part_ids(tmp_path):
+    model_file = tmp_path / "desk.step"
+    models.desk_model().save(str(model_file))
+    cache_file = tmp_path / "desk.jq"
+
+    sr = StepReader()
+    sr.load(str(model_file))
+    sr.save_assembly(str(cache_file))
+
+    sr2 = StepReader()
+    sr2.load_assembly(str(cache_file), part_ids={"leg1"})
+    for obj in sr2.assemblies[0]["shapes"]:
+        if obj["name"] == "leg1":
+            assert not isinstance(obj["shape"], ShapeRef)
+        else:
+            assert isinstance(obj["shape"], ShapeRef)
+            assert resolve_shape(obj).ShapeType() == TopAbs_SOLID
+            assert not isinstance(obj["shape"], ShapeRef)
+
+
+def test_StepReader_colors(tmp_path):
+    model_file = tmp_path / "colored.step"
+    assy = cq.Assembly(name="colored")
+    assy.add(cq.Workplane("XY").box(1, 1, 1), name="red", color=cq.Color("red"))
+    assy.add(cq.Workplane("XY").sphere(1), name="plain")
+    assy.save(str(model_file))
+
+    sr = StepReader()
+    sr.load(str(model_file))
+    colors = {obj["name"]: obj["color"] for obj in sr.assemblies[0]["shapes"]}
+    assert colors == {"red": (1.0, 0.0, 0.0, 1.0), "plain": DEFAULT_COLOR}
+
+    # the geometry only profile does no color analysis at all
+    sr2 = StepReader.geometry_only()
+    sr2.load(str(model_file))
+    assert sr2.color_index is None
+    colors = {obj["name"]: obj["color"] for obj in sr2.assemblies[0]["shapes"]}
+    assert colors == {"red": DEFAULT_COLOR, "plain": DEFAULT_COLOR}
+
+
+def instances_model():
+    screw = cq.Assembly(name="screw")
+    screw.add(cq.Workplane("XY").cylinder(5, 1), name="screw_body")
+    assy = cq.Assembly(name="instances")
+    for i in range(4):
+        assy.add(screw, name=f"screw{i}", loc=cq.Location((3 * i, 0, 0)))
+    return assy
+
+
+def test_StepReader_prototypes(tmp_path):
+    model_file = tmp_path / "instances.step"
+    instances_model().save(str(model_file))
+
+    sr = StepReader()
+    sr.load(str(model_file))
+    leaves = [
+        obj
+        for occurrence in sr.assemblies[0]["shapes"]
+        for obj in (occurrence["shapes"] or [occurrence])
+        if obj["shape"] is not None
+    ]
+    assert len(leaves) == 4
+    # all occurrences share one prototype and its shape
+    assert len({obj["proto"] for obj in leaves}) == 1
+    assert all(obj["shape"] is leaves[0]["shape"] for obj in leaves)
+    assert leaves[0]["proto"] in sr.prototypes
+
+    # the shape is only stored once in the cache
+    cache_file = tmp_path / "instances.jq"
+    sr.save_assembly(str(cache_file))
+    cache = AssemblyCache.open(str(cache_file))
+    assert len({e["offset"] for e in cache.entries if e["offset"] is not None}) == 1
+
+    sr2 = StepReader()
+    sr2.load_assembly(str(cache_file))
+    shapes = [
+        resolve_shape(obj)
+        for occurrence in sr2.assemblies[0]["shapes"]
+        for obj in occurrence["shapes"]
+    ]
+    assert all(shape is shapes[0] for shape in shapes)
+    assert len(sr2.prototypes) == len(sr.prototypes)
+    assert stepscan.part_names(sr2.assemblies) == stepscan.part_names(sr.assemblies)
+
+
+def save_multi_root_model(filename):
+    # a STEP file with three top level products (roots)
+    doc = TDocStd_Document(TCollection_ExtendedString("XmlOcaf"))
+    shape_tool = XCAFDoc_DocumentTool.ShapeTool_s(doc.Main())
+    for name, solid in [
+        ("box", cq.Solid.makeBox(1, 1, 1)),
+        ("sphere", cq.Solid.makeSphere(1)),
+        ("cone", cq.Solid.makeCone(1, 0, 2)),
+    ]:
+        label = shape_tool.AddShape(solid.wrapped, False)
+        TDataStd_Name.Set_s(label, TCollection_ExtendedString(name))
+    writer = STEPCAFControl_Writer()
+    writer.SetNameMode(True)
+    writer.Transfer(doc, STEPControl_AsIs)
+    writer.Write(filename)
+
+
+def test_StepReader_selective(tmp_path):
+    model_file = tmp_path / "roots.step"
+    save_multi_root_model(str(model_file))
+    cache_dir = tmp_path / "cache"
+
+    sr = StepReader()
+    sr.load(
+        str(model_file), cache_dir=str(cache_dir), part_ids={"sphere"}, selective=True
+    )
+    assert stepscan.part_names(sr.assemblies) == ["box", "sphere", "cone"]
+    assert sr.unresolved == ["box", "cone"]
+    shapes = {obj.name: obj.shape for obj in sr.assemblies}
+    assert shapes["sphere"] is not None
+    assert shapes["box"] is None and shapes["cone"] is None
+    # partial results are cached for their set of roots
+    assert len(os.listdir(cache_dir)) == 1
+    sr1 = StepReader()
+    sr1.load(
+        str(model_file), cache_dir=str(cache_dir), part_ids={"sphere"}, selective=True
+    )
+    assert sr1.shape_tool is None
+    assert sr1.unresolved == ["box", "cone"]
+    assert {obj.name: obj.shape is None for obj in sr1.assemblies} == {
+        "box": True,
+        "sphere": False,
+        "cone": True,
+    }
+
+    # all roots are needed, this is a complete load
+    sr2 = StepReader()
+    sr2.load(
+        str(model_file),
+        cache_dir=str(cache_dir),
+        part_ids={"box", "sphere", "cone"},
+        selective=True,
+    )
+    assert sr2.shape_tool is not None
+    assert sr2.unresolved == []
+    assert all(obj.shape is not None for obj in sr2.assemblies)
+    assert len(os.listdir(cache_dir)) == 2
+
+    # a complete cache serves selective loads as well
+    sr3 = StepReader()
+    sr3.load(
+        str(model_file), cache_dir=str(cache_dir), part_ids={"cone"}, selective=True
+    )
+    assert sr3.shape_tool is None
+    assert sr3.unresolved == []
+
+
+def test_StepReader_selective_unmatched(tmp_path, monkeypatch):
+    model_file = tmp_path / "roots.step"
+    save_multi_root_model(str(model_file))
+
+    # roots that do not line up with the scan fall back to a full transfer
+    def select_roots(self, filename, part_ids):
+        return [({"name": name, "shapes": None}, name == "c") for name in "abc"]
+
+    monkeypatch.setattr(StepReader, "select_roots", select_roots)
+    sr = StepReader()
+    with pytest.warns(RuntimeWarning, match="Cannot match the roots"):
+        sr.load(
+            str(model_file),
+            cache_dir=str(tmp_path / "cache"),
+            part_ids={"cone"},
+            selective=True,
+        )
+    assert sr.unresolved == []
+    assert stepscan.part_names(sr.assemblies) == ["box", "sphere", "cone"]
+    assert all(obj.shape is not None for obj in sr.assemblies)
@@ -0,0 +1,39 @@
+import cadquery as cq
+import pytest
+
+from stepcvt import stepscan
+from stepcvt.project import CADSource
+import models
+
+
+def multi_model():
+    assy = cq.Assembly(name="multi")
+    two_boxes = (
+        cq.Workplane("XY")
+        .box(1, 1, 1)
+        .union(cq.Workplane("XY").box(1, 1, 1).translate((3, 0, 0)))
+    )
+    assy.add(two_boxes, name="two_boxes", color=cq.Color("green"))
+    assy.add(cq.Workplane("XY").box(1, 2, 1), name="plain")
+    return assy
+
+
+@pytest.mark.parametrize(
+    "model", [models.book_model, models.torch_model, models.desk_model, multi_model]
+)
+def test_part_ids(tmp_path, model):
+    model_file = tmp_path / "model.step"
+    model().save(str(model_file))
+
+    cs = CADSource.load_step_file("model", model_file)
+    expected = [partid for partid, _ in cs.parts()]
+
+    assert stepscan.part_ids(str(model_file)) == expected
+    assert CADSource("model", model_file).part_ids() == expected
+    assert cs.part_ids() == expected
+
+
+def test_decode_string():
+    assert stepscan.decode_string(b"it''s") == "it's"
+    assert stepscan.decode_string(b"\\X2\\00E9\\X0\\t\\X\\E9") == "été"
+    assert stepscan.decode_string(b"a\\\\b") == "a\\b"
@@ -1,6 +1,9 @@
-from cadquery import Compound
+from argparse import Namespace
+from cadquery import Compound, Solid
 import pytest
-from stepcvt.project import STLConversionInfo
+from stepcvt import export
+from stepcvt.cli import task
+from stepcvt.project import STLConversionInfo, Project, CADSource, PartInfo
 from models import MODELS
 
 
@@ -50,3 +53,47 @@ def test_STLConverstionInfo_rotate():
     assert isinstance(rotated, Compound)
     # rotated angle is the same as the sltcvt rotation param
     assert rotated.location().toTuple()[1] == stlcvt.rotation
+
+
+def test_STLConversionInfo_adaptive():
+    x = STLConversionInfo(
+        rotation=[0, 0, 0],
+        linearTolerance=0.1,
+        angularTolerance=0.1,
+        relativeTolerance=0.001,
+        triangleBudget=5000,
+    )
+    d = x.to_dict()
+    assert d["relativeTolerance"] == 0.001
+    assert d["triangleBudget"] == 5000
+
+    y = STLConversionInfo.from_dict(d)
+    assert y.relativeTolerance == 0.001
+    assert y.triangleBudget == 5000
+
+    # not written unless set
+    d = STLConversionInfo([0, 0, 0], 0.1, 0.1).to_dict()
+    assert "relativeTolerance" not in d
+    assert "triangleBudget" not in d
+
+
+@pytest.mark.parametrize(
+    "adaptive", [{"relativeTolerance": 0.01}, {"triangleBudget": 500}]
+)
+def test_stlconvert_adaptive(adaptive):
+    info = PartInfo("sphere")
+    p = Project("Sphere", sources=[CADSource("sphere", None, [info])])
+    args = dict(
+        partID="sphere",
+        rotation=None,
+        linearTolerance=None,
+        angularTolerance=None,
+        relativeTolerance=None,
+        triangleBudget=None,
+    )
+    task.stlconvert(p, Namespace(**{**args, **adaptive}))
+    # the tolerances that were not given are left to the adaptive mode
+    options = info.stl_options()
+    assert options["tolerance"] is None and options["angularTolerance"] is None
+    meshed = export.MeshedShape(Solid.makeSphere(3), options)
+    assert meshed.angular_tolerance == export.ADAPTIVE_ANGULAR_TOLERANCE
@@ -0,0 +1,98 @@
+import zipfile
+import xml.etree.ElementTree as ET
+
+import cadquery as cq
+import numpy as np
+import pytest
+
+from stepcvt import export, mesh, threemf
+from stepcvt.export import ExportJob
+
+NS = {"m": "http://schemas.microsoft.com/3dmanufacturing/core/2015/02"}
+
+
+def read_model(filename):
+    with zipfile.ZipFile(filename) as package:
+        assert "[Content_Types].xml" in package.namelist()
+        assert "_rels/.rels" in package.namelist()
+        root = ET.fromstring(package.read("3D/3dmodel.model"))
+
+    objects = {}
+    for obj in root.iterfind("m:resources/m:object", NS):
+        vertices = np.array(
+            [
+                [float(v.get(c)) for c in "xyz"]
+                for v in obj.iterfind("m:mesh/m:vertices/m:vertex", NS)
+            ]
+        )
+        triangles = np.array(
+            [
+                [int(t.get(c)) for c in ("v1", "v2", "v3")]
+                for t in obj.iterfind("m:mesh/m:triangles/m:triangle", NS)
+            ]
+        )
+        objects[obj.get("id")] = mesh.Mesh(vertices, triangles)
+
+    items = []
+    for item in root.iterfind("m:build/m:item", NS):
+        values = np.array([float(v) for v in item.get("transform").split()])
+        matrix = values.reshape(4, 3)
+        items.append((item.get("objectid"), matrix[:3].T, matrix[3]))
+    return objects, items
+
+
+def test_write_3mf(tmp_path):
+    cone = cq.Solid.makeCone(2, 1, 5)
+    rotated = {"rotation": [30, 45, 10], "scale": 2.0}
+    jobs = [
+        ExportJob("cone", cone, tmp_path / "cone.stl", rotated),
+        ExportJob("cones", cone, tmp_path / "cones.stl", {"copies": 3}),
+        # identical geometry in another part
+        ExportJob("other", cq.Solid.makeCone(2, 1, 5), tmp_path / "other.stl"),
+        ExportJob("sphere", cq.Solid.makeSphere(2), tmp_path / "sphere.stl"),
+    ]
+    filename = tmp_path / "kit.3mf"
+    result = threemf.write_3mf(jobs, filename)
+    assert result["objects"] == 2
+    assert result["items"] == 6
+
+    objects, items = read_model(filename)
+    assert len(objects) == 2
+    assert [objectid for objectid, _, _ in items] == ["1", "1", "1", "1", "1", "2"]
+
+    # every edge of the objects is shared by two triangles
+    for obj in objects.values():
+        t = obj.triangles
+        edges = np.sort(np.concatenate([t[:, [0, 1]], t[:, [1, 2]], t[:, [2, 0]]]), 1)
+        _, counts = np.unique(edges, axis=0, return_counts=True)
+        assert set(counts) == {2}
+
+    # the build items place the objects as in the STL files
+    export.export(jobs[:2], writer="numpy")
+
+    def stl_bounds(name):
+        data = (tmp_path / name).read_bytes()
+        records = np.frombuffer(data[84:], dtype=mesh._STL_RECORD)
+        vertices = records["vertices"].reshape(-1, 3)
+        return vertices.min(0), vertices.max(0)
+
+    placed = [objects[i].vertices @ matrix.T + offset for i, matrix, offset in items]
+    assert np.allclose(
+        (placed[0].min(0), placed[0].max(0)), stl_bounds("cone.stl"), atol=1e-4
+    )
+    copies = np.concatenate(placed[1:4])
+    assert np.allclose(
+        (copies.min(0), copies.max(0)), stl_bounds("cones.stl"), atol=1e-4
+    )
+
+
+def test_write_3mf_error(tmp_path, monkeypatch):
+    def fail(*args):
+        raise RuntimeError("no space left")
+
+    monkeypatch.setattr(threemf, "write_object", fail)
+    jobs = [ExportJob("sphere", cq.Solid.makeSphere(2), tmp_path / "sphere.stl")]
+    with pytest.raises(RuntimeError):
+        threemf.write_3mf(jobs, tmp_path / "kit.3mf")
+    # neither the package nor its temporary file are left behind
+    assert list(tmp_path.iterdir()) == []